@@ -0,0 +1,229 @@
+"""ASGI entry point of the report API.
+
+    uvicorn asgi:application
+
+The report, driver list and driver detail endpoints, and their race routes, are
+served natively on the event loop. Their report is loaded in a worker thread
+through asyncio.to_thread and rendered in one by the same resources, renderers and
+response cache as the WSGI app; the body is then sent from the loop, so a client
+that is slow to read holds no thread. The leaderboard stream is native as well, an
+open Server-Sent Events connection holds no thread at all. Every other request goes
+through the Flask app behind the a2wsgi adapter and holds a thread of its pool, up
+to WSGI_THREADS at once, while it is in flight.
+"""
+import asyncio
+import contextlib
+import io
+import logging
+import os
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import request
+from werkzeug.exceptions import HTTPException
+
+import leaderboard
+import main
+import report_racers
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/api/v1/report/stream/'
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 10))
+CHUNK_SIZE = 64 * 1024
+# the endpoints served natively, by the name of their Flask endpoint
+NATIVE_RESOURCES = {
+    'indexapi': main.IndexApi,
+    'infodriver': main.InfoDriver,
+    'namepage': main.NamePage,
+}
+
+app = main.create_app(share_reports=True)
+wsgi = WSGIMiddleware(app, workers=WSGI_THREADS)
+
+
+class AsyncSubscriber:
+    """A subscriber that receives messages on an event loop. Messages are pushed
+    from the refresher thread, so they are handed over to the loop, where the
+    subscriber is dropped and resynced like a QueueSubscriber when it falls behind."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = 16):
+        self.loop = loop
+        self.messages = asyncio.Queue(maxsize)
+        self.resync = False
+
+    def push(self, version, message: bytes):
+        self.loop.call_soon_threadsafe(self._put, (version, message))
+
+    def _put(self, event: tuple):
+        try:
+            self.messages.put_nowait(event)
+        except asyncio.QueueFull:
+            self.resync = True
+
+    async def get(self, timeout: float | None = None) -> tuple | None:
+        """Returns the next (version, message) pair, or None when nothing came in
+        within the timeout"""
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def drain(self):
+        self.resync = False
+        while not self.messages.empty():
+            self.messages.get_nowait()
+
+
+async def stream_events(hub: leaderboard.LeaderboardHub, subscriber: AsyncSubscriber,
+                        keepalive: float = leaderboard.KEEPALIVE_INTERVAL):
+    """Yields the same events as LeaderboardHub.stream for a subscriber on the event loop.
+    The snapshot is built in a worker thread, so a reload of the data files never blocks the loop"""
+    try:
+        version, message = await asyncio.to_thread(hub.snapshot)
+        yield message
+        while True:
+            event = await subscriber.get(timeout=keepalive)
+            if subscriber.resync:
+                subscriber.drain()
+                version, message = await asyncio.to_thread(hub.snapshot)
+                yield message
+            elif event is None:
+                yield b': keepalive\n\n'
+            elif event[0] != version:
+                version, message = event
+                yield message
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+async def leaderboard_stream(scope: dict, receive, send):
+    """Serves the leaderboard Server-Sent Events stream on the event loop.
+    The subscriber is dropped as soon as the client disconnects"""
+    hub = main.leaderboard_hub
+    hub.ensure_watching()
+    subscriber = hub.subscribe(AsyncSubscriber(asyncio.get_running_loop()))
+    disconnected = asyncio.ensure_future(receive_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                        (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')],
+        })
+        async with contextlib.aclosing(stream_events(hub, subscriber)) as events:
+            while True:
+                event = asyncio.ensure_future(anext(events))
+                await asyncio.wait((event, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if not event.done():
+                    event.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await event
+                    break
+                await send({'type': 'http.response.body', 'body': event.result(), 'more_body': True})
+    finally:
+        disconnected.cancel()
+        hub.unsubscribe(subscriber)
+
+
+def native_resource(environ: dict):
+    """Returns the resource serving a request natively, None for a request of the WSGI app"""
+    if environ['REQUEST_METHOD'] != 'GET':
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return NATIVE_RESOURCES.get(endpoint)
+
+
+async def serve_resource(resource, environ: dict, send):
+    """Serves a request with a report resource. The report is loaded and rendered in worker
+    threads, which see the request context, and the response runs through the hooks of the app
+    like a dispatched request"""
+    with app.request_context(environ):
+        try:
+            response = app.preprocess_request()
+            if response is None:
+                values = request.view_args
+                report = await asyncio.to_thread(
+                    main.load_report, request.args.get('order', 'asc'), values.get('race_id'))
+                response = await asyncio.to_thread(resource().render_report, report, **values)
+        except Exception as error:
+            response = app.handle_user_exception(error)
+        response = app.process_response(app.make_response(response))
+        await send_response(response, environ, send)
+
+
+def read_chunk(iterator) -> tuple[bytes, bool]:
+    """This function reads up to CHUNK_SIZE bytes of a streamed body.
+    returns the chunk and whether there is more to read"""
+    parts, size = [], 0
+    for part in iterator:
+        parts.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            return b''.join(parts), True
+    return b''.join(parts), False
+
+
+async def send_response(response, environ: dict, send):
+    """Sends a response from the event loop in chunks of CHUNK_SIZE, each waiting for the client
+    to take the previous one. A streamed body is written in a worker thread chunk by chunk"""
+    headers = response.get_wsgi_headers(environ)
+    body = response.get_app_iter(environ)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        if response.is_streamed:
+            iterator, more = iter(body), True
+            while more:
+                chunk, more = await asyncio.to_thread(read_chunk, iterator)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+        else:
+            data = b''.join(body)
+            for start in range(0, max(len(data), 1), CHUNK_SIZE):
+                chunk = data[start:start + CHUNK_SIZE]
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': start + CHUNK_SIZE < len(data)})
+    finally:
+        response.close()
+
+
+async def receive_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def lifespan(receive, send):
+    """Loads the report in a worker thread before the server accepts requests"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await asyncio.to_thread(report_racers.build_report, 'asc')
+            except OSError as error:
+                logger.warning("Race data could not be loaded at startup: %s", error)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope: dict, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] != 'http':
+        raise ValueError(f"Unsupported scope type {scope['type']}")
+    elif scope['method'] == 'GET' and scope['path'] == STREAM_PATH:
+        await leaderboard_stream(scope, receive, send)
+    else:
+        environ = build_environ(scope, io.BytesIO())
+        resource = native_resource(environ)
+        if resource is None:
+            await wsgi(scope, receive, send)
+        else:
+            await serve_resource(resource, environ, send)
@@ -0,0 +1,168 @@
+"""Benchmark suite of the report pipeline on synthetic races.
+
+For every field size it generates the data files with synthetic_race, times
+parse_race_file, parser_drivers, build_report (cold and cached), get_racer_data
+and every renderer, then measures the request throughput of the API through the
+Flask test client. Results are written as JSON, and a previous results file can
+be given to print how every measurement changed. Run from the project root:
+
+    python benchmarks/bench_report.py --drivers 20 1000 100000 --output before.json
+    python benchmarks/bench_report.py --drivers 20 1000 100000 --compare before.json
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import report_racers  # noqa: E402
+import main  # noqa: E402
+from synthetic_race import write_race  # noqa: E402
+
+ENDPOINTS = (
+    '/api/v1/report/?format=json',
+    '/api/v1/report/?format=xml',
+    '/api/v1/report/?format=ndjson',
+    '/api/v1/report/?format=json&limit=15',
+    '/api/v1/report/?format=records',
+    '/api/v1/report/drivers/?format=json',
+)
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """Calls func repeat times, after setup when given. returns the timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {'runs': repeat, 'min': min(timings), 'median': statistics.median(timings),
+            'mean': statistics.fmean(timings)}
+
+
+def throughput(client, path: str, requests: int, budget: float, cached: bool) -> dict:
+    """Sends up to requests GET requests within budget seconds, at least one.
+    Without cached, the response cache is cleared before every request"""
+    count = 0
+    started = time.perf_counter()
+    while count < requests and (count == 0 or time.perf_counter() - started < budget):
+        if not cached:
+            main.response_cache.clear()
+        response = client.get(path)
+        response.get_data()
+        response.close()
+        assert response.status_code == 200, (path, response.status_code)
+        count += 1
+    elapsed = time.perf_counter() - started
+    return {'runs': count, 'mean': elapsed / count, 'requests_per_second': count / elapsed}
+
+
+def bench_race(data_dir: Path, drivers: int, args) -> list[dict]:
+    counts = write_race(data_dir, drivers, seed=args.seed)
+    start_file, end_file, abbr_file = (data_dir / 'start.log', data_dir / 'end.log',
+                                       data_dir / 'abbreviations.txt')
+    results = []
+
+    def record(stage, timings):
+        results.append({'drivers': drivers, 'stage': stage, **timings})
+        print(f"{drivers:>9} {stage:<55} {timings['mean'] * 1000:12.3f} ms  ({timings['runs']} runs)")
+
+    record('parse_race_file', measure(lambda: report_racers.parse_race_file(start_file), args.repeat))
+    record('parser_drivers', measure(lambda: report_racers.parser_drivers(abbr_file), args.repeat))
+
+    cache = report_racers.report_cache
+    cache.files = (start_file, end_file, abbr_file)
+    record('build_report (cold)',
+           measure(lambda: report_racers.build_report('asc'), args.repeat, report_racers.invalidate_cache))
+    record('build_report (cached)', measure(lambda: report_racers.build_report('asc'), args.repeat))
+
+    report = report_racers.build_report('asc')
+    code, name, team = next(iter(report.values()))
+    record('get_racer_data (index)',
+           measure(lambda: report_racers.get_racer_data(report, code), args.repeat,
+                   lambda: report.__dict__.pop('index', None)))
+    for kind, key in (('code', code), ('name', name), ('team', team)):
+        record(f'get_racer_data ({kind})', measure(lambda: report_racers.get_racer_data(report, key), args.repeat))
+
+    for format_name, render in main.RenderMixin.renders.items():
+        record(f'render {format_name}', measure(lambda: render().dump(report), args.repeat))
+
+    client = main.create_app().test_client()
+    for path in ENDPOINTS:
+        for cached in (False, True):
+            label = f"GET {path} ({'cached' if cached else 'uncached'})"
+            record(label, throughput(client, path, args.requests, args.budget, cached))
+    results.append({'drivers': drivers, 'stage': 'data', **counts})
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], previous_file: Path):
+    """Prints the change of the mean of every measurement against a previous run"""
+    previous = {(result['drivers'], result['stage']): result
+                for result in json.loads(previous_file.read_text())['results']}
+    print(f'\nchange against {previous_file}:')
+    for result in results:
+        before = previous.get((result['drivers'], result['stage']))
+        if before is None or 'mean' not in result:
+            continue
+        print(f"{result['drivers']:>9} {result['stage']:<45} {result['mean'] / before['mean']:8.2f}x")
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, nargs='+', default=[20, 1000, 100_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='the maximum number of requests per endpoint')
+    parser.add_argument('--budget', type=float, default=2.0,
+                        help='the seconds after which the requests to an endpoint stop')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help='the JSON file to write the results to')
+    parser.add_argument('--compare', type=Path, help='a JSON file of a previous run')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    results = []
+    original_files = report_racers.report_cache.files
+    try:
+        for drivers in args.drivers:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                results.extend(bench_race(Path(tmp_dir), drivers, args))
+    finally:
+        report_racers.report_cache.files = original_files
+        report_racers.invalidate_cache()
+
+    output = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'results': results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(output, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,66 @@
+"""Startup time of a worker: importing main and creating the app.
+
+Every run is a fresh interpreter started with -X importtime, so the result is
+what a newly spawned worker pays before it can serve its first request. Prints
+the median wall time and the slowest top-level imports, and can write the runs
+to JSON. Run from the project root:
+
+    python benchmarks/bench_startup.py --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CHILD = ('import time; started = time.perf_counter(); import main; main.create_app(); '
+         'print(time.perf_counter() - started)')
+
+
+def start_worker(env: dict) -> tuple[float, dict[str, int]]:
+    """Imports main and creates the app in a new interpreter. returns the wall time
+    in seconds and the cumulative import time in microseconds of every import made
+    at the top level or directly by a top-level module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level <= 1:
+            imports[name.strip()] = int(cumulative)
+    return float(result.stdout.strip().splitlines()[-1]), imports
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='the number of slowest imports to print')
+    parser.add_argument('--output', type=Path, help='the JSON file to write the runs to')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    start_worker(env)
+    runs = [start_worker(env) for _ in range(args.runs)]
+    times = [wall for wall, _ in runs]
+    imports = {name: statistics.median(run_imports.get(name, 0) for _, run_imports in runs)
+               for name in runs[0][1]}
+
+    print(f'runs:           {args.runs}')
+    print(f'median startup: {statistics.median(times) * 1000:.1f} ms')
+    print(f'min startup:    {min(times) * 1000:.1f} ms')
+    print('slowest imports (median cumulative):')
+    for name, micros in sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f'  {name:<30} {micros / 1000:8.1f} ms')
+    if args.output:
+        args.output.write_text(json.dumps({'startup_seconds': times, 'imports_microseconds': imports}, indent=2))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,55 @@
+"""Micro-benchmark of the timestamp parsers used for start.log and end.log.
+
+Compares datetime.strptime with report_racers.parse_timestamp on a synthetic
+log and prints the time each one takes. Run from the project root:
+
+    python benchmarks/bench_timestamps.py --lines 1000000
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import report_racers  # noqa: E402
+
+
+def synthetic_times(lines: int) -> list[str]:
+    """Returns the time part of a synthetic log with the given number of lines"""
+    start = datetime(2018, 5, 24, 12, 0, 0)
+    step = timedelta(milliseconds=37)
+    return [(start + step * i).strftime(report_racers.DATETIME_FORMAT)[:-3]
+            for i in range(lines)]
+
+
+def measure(parser, values: list[str]) -> float:
+    started = time.perf_counter()
+    for value in values:
+        parser(value)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    values = synthetic_times(args.lines)
+    assert all(report_racers.parse_timestamp(value) ==
+               datetime.strptime(value, report_racers.DATETIME_FORMAT)
+               for value in values[:1000])
+
+    slow = measure(
+        lambda value: datetime.strptime(value, report_racers.DATETIME_FORMAT),
+        values)
+    fast = measure(report_racers.parse_timestamp, values)
+    print(f'lines:           {args.lines}')
+    print(f'strptime:        {slow:.3f}s')
+    print(f'parse_timestamp: {fast:.3f}s')
+    print(f'speedup:         {slow / fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Load harness for the leaderboard Server-Sent Events endpoint.
+
+Serves the app on localhost from a temporary copy of the data files, connects
+the given number of subscribers to /api/v1/report/stream/, appends a finish
+time to the copied end.log and reports how long the diff took to reach every
+subscriber. Run from the project root:
+
+    python benchmarks/sse_subscribers.py --subscribers 300
+"""
+import argparse
+import http.client
+import logging
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import report_racers  # noqa: E402
+import main  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+STREAM_PATH = '/api/v1/report/stream/'
+
+
+def read_event(response) -> bytes:
+    """Reads one Server-Sent Events message, skipping keepalive comments"""
+    lines = []
+    while True:
+        line = response.readline()
+        if not line:
+            raise ConnectionError('stream closed')
+        if line == b'\n':
+            if lines:
+                return b''.join(lines)
+            continue
+        if not line.startswith(b':'):
+            lines.append(line)
+
+
+def subscriber(port, ready, received, errors):
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        connection.request('GET', STREAM_PATH)
+        response = connection.getresponse()
+        read_event(response)
+        ready.release()
+        read_event(response)
+        received.append(time.perf_counter())
+        connection.close()
+    except Exception as error:  # noqa: BLE001 - the harness reports every failure
+        errors.append(error)
+        ready.release()
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subscribers', type=int, default=300)
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help='polling interval of the report refresher in seconds')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for file in (report_racers.STARTLOG_FILE, report_racers.ENDLOG_FILE, report_racers.ABBR_FILE):
+            files.append(Path(shutil.copy(file, tmp_dir)))
+        report_racers.report_cache.files = tuple(files)
+        report_racers.invalidate_cache()
+        report_racers.report_cache.follow()
+        main.leaderboard_hub.ensure_watching(args.interval)
+
+        server = make_server('127.0.0.1', 0, main.create_app(), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        ready = threading.Semaphore(0)
+        received, errors = [], []
+        clients = [threading.Thread(target=subscriber, args=(server.port, ready, received, errors), daemon=True)
+                   for _ in range(args.subscribers)]
+        for client in clients:
+            client.start()
+        for _ in clients:
+            ready.acquire()
+
+        start_file, end_file, abbr_file = files
+        with open(start_file, 'a') as fp:
+            fp.write('\nXXX2018-05-24_12:00:00.000\n')
+        with open(end_file, 'a') as fp:
+            fp.write('\nXXX2018-05-24_12:00:30.000\n')
+        changed = time.perf_counter()
+        for client in clients:
+            client.join(timeout=30)
+        server.shutdown()
+
+    latencies = sorted(moment - changed for moment in received)
+    print(f'subscribers:  {args.subscribers}')
+    print(f'received:     {len(received)}')
+    print(f'errors:       {len(errors)}')
+    if latencies:
+        print(f'median delay: {statistics.median(latencies) * 1000:.1f} ms')
+        print(f'max delay:    {latencies[-1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,108 @@
+"""Generator of synthetic race data for the benchmarks.
+
+Writes start.log, end.log and abbreviations.txt for any number of drivers, from
+a 20 driver field up to a million, with the edge cases the parser has to cope
+with mixed in: start and end times swapped between the logs, drivers with
+identical lap times, drivers that never finished, blank and malformed lines.
+Run from the project root:
+
+    python benchmarks/synthetic_race.py --drivers 100000 --out /tmp/race
+"""
+import argparse
+import random
+import string
+from pathlib import Path
+
+# The logs hold a three character code per driver, so the alphabet adds Greek
+# letters to the ASCII ones to have more than a million unique codes.
+CODE_ALPHABET = (string.ascii_uppercase + string.digits + string.ascii_lowercase
+                 + ''.join(map(chr, range(0x391, 0x3a2))) + ''.join(map(chr, range(0x3a3, 0x3aa)))
+                 + ''.join(map(chr, range(0x3b1, 0x3ca))))
+FIRST_NAMES = ('Sebastian', 'Lewis', 'Valtteri', 'Kimi', 'Daniel', 'Max', 'Fernando',
+               'Charles', 'Sergio', 'Esteban', 'Carlos', 'Nico', 'Pierre', 'Lance')
+LAST_NAMES = ('Vettel', 'Hamilton', 'Bottas', 'Raikkonen', 'Ricciardo', 'Verstappen', 'Alonso',
+              'Leclerc', 'Perez', 'Ocon', 'Sainz', 'Hulkenberg', 'Gasly', 'Stroll')
+TEAMS = ('FERRARI', 'MERCEDES', 'RED BULL RACING TAG HEUER', 'McLAREN RENAULT', 'RENAULT',
+         'SAUBER FERRARI', 'WILLIAMS MERCEDES', 'HAAS FERRARI', 'FORCE INDIA MERCEDES',
+         'SCUDERIA TORO ROSSO HONDA')
+DATE = '2018-05-24'
+RACE_START_MS = 12 * 3_600_000
+MAX_DRIVERS = len(CODE_ALPHABET) ** 3
+
+
+def driver_codes(count: int) -> list[str]:
+    """Returns count unique three character codes"""
+    if count > MAX_DRIVERS:
+        raise ValueError(f'At most {MAX_DRIVERS} drivers have a unique code')
+    size = len(CODE_ALPHABET)
+    return [CODE_ALPHABET[i // (size * size)] + CODE_ALPHABET[i // size % size] + CODE_ALPHABET[i % size]
+            for i in range(count)]
+
+
+def log_time(ms: int) -> str:
+    hours, ms = divmod(ms, 3_600_000)
+    minutes, ms = divmod(ms, 60_000)
+    seconds, ms = divmod(ms, 1000)
+    return f'{DATE}_{hours:02d}:{minutes:02d}:{seconds:02d}.{ms:03d}'
+
+
+def pick(rng: random.Random, population: range, fraction: float) -> set[int]:
+    """Picks a fraction of the population, at least one when the fraction is not zero"""
+    if not fraction or not population:
+        return set()
+    return set(rng.sample(population, min(len(population), max(1, round(len(population) * fraction)))))
+
+
+def write_race(directory: Path, drivers: int, seed: int = 0, swapped: float = 0.01,
+               ties: float = 0.01, unfinished: float = 0.01, malformed: float = 0.001) -> dict:
+    """Writes the data files of a synthetic race to directory.
+    The fractions set how many drivers get their times swapped between the logs,
+    share the lap of the previous driver, have no finish time, and how many
+    malformed lines are mixed into each log; every case occurs at least once
+    unless its fraction is zero. returns the counts of each case"""
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    codes = driver_codes(drivers)
+    swapped, ties, unfinished = (pick(rng, range(drivers), swapped), pick(rng, range(1, drivers), ties),
+                                 pick(rng, range(drivers), unfinished))
+    counts = {'drivers': drivers, 'swapped': len(swapped), 'ties': len(ties),
+              'unfinished': len(unfinished), 'malformed': 0}
+    start_lines, end_lines = [], []
+    for i, code in enumerate(codes):
+        if i not in ties:
+            start = RACE_START_MS + rng.randrange(36_000_000)
+            end = start + rng.randrange(60_000, 80_000)
+        start_line, end_line = code + log_time(start), code + log_time(end)
+        if i in swapped:
+            start_line, end_line = end_line, start_line
+        start_lines.append(start_line)
+        if i not in unfinished:
+            end_lines.append(end_line)
+    for lines in (start_lines, end_lines):
+        rng.shuffle(lines)
+        for _ in range(len(pick(rng, range(len(lines)), malformed))):
+            lines.insert(rng.randrange(len(lines) + 1), rng.choice(('', 'XXX', 'XXX2018-05-24_99:99')))
+            counts['malformed'] += 1
+    (directory / 'start.log').write_text('\n'.join(start_lines) + '\n', encoding='utf-8')
+    (directory / 'end.log').write_text('\n'.join(end_lines) + '\n', encoding='utf-8')
+    with open(directory / 'abbreviations.txt', 'w', encoding='utf-8') as fp:
+        for i, code in enumerate(codes):
+            name = f'{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]}'
+            if i >= len(FIRST_NAMES) * len(LAST_NAMES):
+                name += f' {i}'
+            fp.write(f'{code}_{name}_{TEAMS[i % len(TEAMS)]}\n')
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--out', type=Path, required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(write_race(args.out, args.drivers, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""Compiles the race data files into binary snapshots.
+
+Writes report.snap next to start.log, end.log and abbreviations.txt of the
+default race and of every race of the catalog. Workers read a snapshot that
+matches the current data files instead of parsing the logs. Run it after the
+data files change, for example at deploy time:
+
+    python compile_snapshot.py
+"""
+import report_racers
+
+
+def main():
+    caches = [report_racers.report_cache]
+    caches += [report_racers.race_catalog.cache(race_id) for race_id in report_racers.race_catalog.races()]
+    for cache in caches:
+        print(cache.compile_snapshot())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""Gunicorn settings of the production server, see wsgi.py.
+
+The app is preloaded in the master, so the race data is parsed once and shared
+by every worker. A worker per core with a few threads each keeps the throughput
+and the memory per core predictable; the threads cover clients that are slow to
+read.
+
+A gthread worker holds one of its threads for as long as a client keeps the
+leaderboard stream (/api/v1/report/stream/) open, so a worker serves at most
+THREADS streams, and every open stream is one thread less for other requests.
+Serve the stream with the ASGI entry point instead (uvicorn asgi:application),
+where an open stream holds no thread, and route only the other requests here;
+or raise THREADS to the number of streams a worker has to hold. WORKER_CLASS
+selects another gunicorn worker type.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('THREADS', 4))
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+preload_app = True
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+timeout = int(os.environ.get('TIMEOUT', 30))
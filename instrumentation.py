@@ -0,0 +1,202 @@
+"""Timing of the stages of a request.
+
+Stages are timed with the `timed` decorator or the `stage` context manager and
+recorded in a histogram per stage, which /metrics exposes in the Prometheus text
+format. The stages of a request are also summed up in its Server-Timing header.
+A request with the profile=1 query parameter or an X-Profile: 1 header is run
+under cProfile and its stats are dumped to PROFILE_DIR.
+
+Instrumentation is off unless the INSTRUMENTATION environment variable is set,
+or `enable()` is called before the app is created. While it is off a timed
+function costs one extra call and a stage is a shared nullcontext.
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', Path(__file__).parent / 'profiles'))
+METRICS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+enabled = os.environ.get('INSTRUMENTATION', '') not in ('', '0')
+
+_timings = contextvars.ContextVar('timings', default=None)
+_disabled = contextlib.nullcontext()
+_profile_numbers = itertools.count()
+
+
+class Histogram:
+    """Counts observed durations in cumulative Prometheus buckets"""
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """Returns the (le, count) pairs of the buckets, up to +Inf"""
+        with self._lock:
+            counts = list(itertools.accumulate(self.counts))
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        return list(zip(bounds, counts))
+
+
+histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def after_fork():
+    """This function renews the locks of the histograms in a forked worker"""
+    global _histograms_lock
+    _histograms_lock = threading.Lock()
+    for histogram in list(histograms.values()):
+        histogram._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+def observe(name: str, seconds: float):
+    """This function records the duration of a stage, in its histogram and in the timings of the current request"""
+    histogram = histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = histograms.setdefault(name, Histogram())
+    histogram.observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+class Stage:
+    """Times the block of a with statement"""
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started)
+
+
+def stage(name: str):
+    """This function returns a context manager timing a stage, a shared nullcontext while disabled"""
+    if not enabled:
+        return _disabled
+    return Stage(name)
+
+
+def timed(name: str):
+    """This decorator times every call of a function as a stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """This function formats stage timings as a Server-Timing header, durations are in milliseconds"""
+    return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings.items())
+
+
+def render_metrics() -> str:
+    """This function writes the stage histograms in the Prometheus text format"""
+    lines = ['# HELP report_stage_seconds Time spent in each stage of a request.',
+             '# TYPE report_stage_seconds histogram']
+    for name, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            lines.append(f'report_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+        lines.append(f'report_stage_seconds_sum{{stage="{name}"}} {histogram.sum}')
+        lines.append(f'report_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def dump_profile(profiler) -> Path:
+    """This function writes the stats of a profiled request to PROFILE_DIR. returns the written file"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(_profile_numbers)}.prof'
+    profiler.dump_stats(path)
+    return path
+
+
+def init_app(app):
+    """This function adds the /metrics endpoint to a Flask app and, while instrumentation
+         is enabled, times its requests"""
+    from flask import Response, g, request
+
+    def metrics():
+        return Response(render_metrics(), mimetype=METRICS_MIMETYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    if not enabled:
+        return
+
+    @app.before_request
+    def start_timing():
+        g.timings_token = _timings.set({})
+        g.started = time.perf_counter()
+        g.profiler = None
+        if request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1':
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                logger.warning('Another request is being profiled, %s is not', request.path)
+            else:
+                g.profiler = profiler
+
+    @app.after_request
+    def add_server_timing(response):
+        if g.get('profiler') is not None:
+            g.profiler.disable()
+            response.headers['X-Profile'] = dump_profile(g.profiler).name
+            g.profiler = None
+        timings = _timings.get()
+        if timings is not None and 'started' in g:
+            observe('request', time.perf_counter() - g.started)
+            response.headers['Server-Timing'] = server_timing(timings)
+        return response
+
+    @app.teardown_request
+    def stop_timing(exc):
+        if g.get('profiler') is not None:
+            g.profiler.disable()
+        if 'timings_token' in g:
+            _timings.reset(g.pop('timings_token'))
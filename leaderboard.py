@@ -0,0 +1,161 @@
+import json
+import os
+import queue
+import threading
+import weakref
+
+import report_racers
+
+KEEPALIVE_INTERVAL = 15.0
+
+hubs = weakref.WeakSet()
+
+
+def leaderboard_rows(report) -> list[tuple]:
+    """This function returns the (time, code, name, team) rows of a report in order"""
+    return [(time, *record) for time, record in report.items()]
+
+
+def leaderboard_diff(old_rows: list[tuple], new_rows: list[tuple], version=None) -> dict:
+    """This function compares two leaderboards. returns the positions whose row changed
+         and the new size of the leaderboard, positions start at 1"""
+    changes = [
+        {'position': position, 'time': row[0], 'code': row[1], 'name': row[2], 'team': row[3]}
+        for position, row in enumerate(new_rows, start=1)
+        if position > len(old_rows) or old_rows[position - 1] != row]
+    return {'version': version, 'size': len(new_rows), 'changes': changes}
+
+
+def sse_message(diff: dict) -> bytes:
+    """This function encodes a leaderboard diff as a Server-Sent Events message"""
+    data = json.dumps(diff, separators=(',', ':'), ensure_ascii=False)
+    return f'id: {diff["version"]}\nevent: leaderboard\ndata: {data}\n\n'.encode('utf-8')
+
+
+class QueueSubscriber:
+    """A subscriber that receives messages through a bounded queue. A subscriber
+    that falls behind is not allowed to hold messages back: its queue is dropped
+    and it is sent the whole leaderboard again once it catches up."""
+
+    def __init__(self, maxsize: int = 16):
+        self.messages = queue.Queue(maxsize)
+        self.resync = False
+
+    def push(self, version, message: bytes):
+        try:
+            self.messages.put_nowait((version, message))
+        except queue.Full:
+            self.resync = True
+
+    def get(self, timeout: float | None = None) -> tuple | None:
+        """Returns the next (version, message) pair, or None when nothing came in
+        within the timeout"""
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        self.resync = False
+        while True:
+            try:
+                self.messages.get_nowait()
+            except queue.Empty:
+                return
+
+
+class LeaderboardHub:
+    """Fans leaderboard diffs out to any number of subscribers.
+    The hub listens to the report cache, so the data files are watched by the
+    single report refresher and every diff is computed and encoded once per
+    change, however many clients are connected, and not at all without clients.
+    The hub keeps only the last published report, a view of the table the cache
+    holds anyway, to diff the next one against."""
+
+    def __init__(self, cache: report_racers.ReportCache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._report = None
+        self._refresher = None
+        cache.listeners.append(self.publish)
+        hubs.add(self)
+
+    def ensure_watching(self, interval: float = 1.0):
+        """Starts the report refresher for the cache unless one is running already.
+        Live ingestion of the logs is a startup setting of the cache, see REPORT_LIVE"""
+        with self._lock:
+            if not self.cache.watched and (self._refresher is None or not self._refresher.is_alive()):
+                self._refresher = report_racers.ReportRefresher(self.cache, interval)
+                self._refresher.start()
+
+    def snapshot(self) -> tuple:
+        """Returns the version and the whole current leaderboard as one message. the state
+        of the hub is left to publish, a report the cache swapped in is diffed and sent to
+        the other subscribers once its listeners are called"""
+        report = self.cache.get('asc')
+        return report.version, sse_message(leaderboard_diff([], leaderboard_rows(report), report.version))
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, report):
+        """Sends the positions that changed in the report to every subscriber. Reports are
+        published one at a time under the lock and a report the cache has replaced already
+        is skipped, so the versions reach the subscribers in order"""
+        with self._lock:
+            previous = self._report
+            if (previous is not None and previous.version == report.version
+                    or not self.cache.is_current(report.table)):
+                return
+            self._report = report
+            if not self._subscribers:
+                return
+            old_rows = [] if previous is None else leaderboard_rows(previous)
+            rows = leaderboard_rows(report)
+            diff = leaderboard_diff(old_rows, rows, report.version)
+            if not diff['changes'] and len(rows) == len(old_rows):
+                return
+            message = sse_message(diff)
+            for subscriber in self._subscribers:
+                subscriber.push(report.version, message)
+
+    def stream(self, subscriber: QueueSubscriber, keepalive: float = KEEPALIVE_INTERVAL):
+        """Yields the Server-Sent Events of one subscriber: the whole leaderboard first,
+        then every later diff, with a comment line whenever nothing changed for a while"""
+        try:
+            version, message = self.snapshot()
+            yield message
+            while True:
+                event = subscriber.get(timeout=keepalive)
+                if subscriber.resync:
+                    subscriber.drain()
+                    version, message = self.snapshot()
+                    yield message
+                elif event is None:
+                    yield b': keepalive\n\n'
+                elif event[0] != version:
+                    version, message = event
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def after_fork():
+    """This function runs in a worker forked from a preloading server. the locks of the hubs
+         are renewed, and the subscribers and refresher of the parent are dropped, since
+         their threads did not survive the fork"""
+    for hub in hubs:
+        hub._lock = threading.Lock()
+        hub._subscribers = set()
+        hub._refresher = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
@@ -1,38 +1,167 @@
-from flask import Flask, render_template, request, jsonify, Response, url_for
+import gzip
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from itertools import islice
+from flask import Flask, render_template, request, Response, url_for, abort, current_app
 from flask_restful import Api, Resource
+from flask_caching import Cache
+from flask_caching.backends import NullCache
 import report_racers
-from flasgger import Swagger
-import xml.etree.ElementTree as ET
+import leaderboard
+import instrumentation
 
-app = Flask(__name__)
-api = Api(app)
-swagger = Swagger(app)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-@app.route('/report')
-def index():
+api = Api()
+cache = Cache()
+# objects whose _lock is renewed in a forked worker
+fork_safe = weakref.WeakSet()
+
+JSON_SEPARATORS = (',', ':')
+REPORT_FIELDS = ('code', 'name', 'team')
+DRIVER_TAGS = ('drivers', 'driver', 'time')
+GAP_FIELDS = ('code', 'name', 'team', 'gap', 'interval', 'percentile', 'band')
+TEAM_FIELDS = ('position', 'best_time', 'best_code', 'drivers', 'mean_time')
+TEAM_TAGS = ('teams', 'team', 'name')
+MAX_BATCH_CODES = 100
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+CACHE_CONFIG_KEYS = ('CACHE_TYPE', 'CACHE_DIR', 'CACHE_REDIS_URL', 'CACHE_KEY_PREFIX',
+                     'CACHE_DEFAULT_TIMEOUT', 'CACHE_THRESHOLD')
+
+compressors = {'gzip': lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0)}
+if brotli is not None:
+    compressors = {'br': lambda body: brotli.compress(body, quality=BROTLI_QUALITY), **compressors}
+
+leaderboard_hub = leaderboard.LeaderboardHub(report_racers.report_cache)
+
+
+def load_report(order, race_id=None):
+    """Returns the report of the default race, or of a race of the catalog"""
+    if race_id is None:
+        return report_racers.build_report(order)
+    try:
+        return report_racers.race_catalog.build_report(race_id, order)
+    except KeyError:
+        abort(404, description=f"Race {race_id} not found")
+
+
+def html_page(data, template, **context):
+    """Returns a rendered page, cached and compressed like the API payloads when the data is a versioned report"""
+    return cached_response(lambda: render_template(template, **context).encode('utf-8'), 'text/html',
+                           getattr(data, 'version', None), 'html', stage='template')
+
+
+def index(race_id):
     '''This route handles the main page'''
     order = request.args.get('order', 'asc')
-    sorted_data = report_racers.build_report(order)
-    return render_template('index.html', report=sorted_data)
+    sorted_data = load_report(order, race_id)
+    return html_page(sorted_data, 'index.html', report=sorted_data)
 
 
-@app.route('/report/drivers/')
-def info_in_drivers():
+def info_in_drivers(race_id):
     '''shows a list of driver's names and codes. The code should be a link to info about drivers'''
     order = request.args.get('order', 'asc')
-    sorted_data = report_racers.build_report(order)
-    return render_template('info_in_drivers.html', report=sorted_data)
+    sorted_data = load_report(order, race_id)
+    links = driver_links(sorted_data, 'name_page', race_id=race_id)
+    return html_page(sorted_data, 'info_in_drivers.html', report=sorted_data, links=links)
 
 
-@app.route('/report/drivers/<name>')
-def name_page(name):
+def name_page(name, race_id):
     '''Returns a page with the name'''
     order = request.args.get('order', 'asc')
-    sorted_data = report_racers.build_report(order)
-    result, racer_data = report_racers.get_racer_data(
-        sorted_data, name).popitem()
-    return render_template('name_page.html', racer=racer_data, report=result)
+    sorted_data = load_report(order, race_id)
+    racer = report_racers.get_racer_data(sorted_data, name)
+    if not racer:
+        abort(404, description=f"Driver {name} not found")
+    result, racer_data = next(iter(racer.items()))
+    return html_page(sorted_data, 'name_page.html', racer=racer_data, report=result)
+
+
+def query_int(name, default=None):
+    """Returns an integer query parameter, a value that is not an integer is answered with 400"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    digits = value[1:] if value.startswith('-') else value
+    if not (digits.isascii() and digits.isdecimal()):
+        abort(400, description=f"{name} must be an integer")
+    return int(value)
+
+
+def report_page(report):
+    """
+    Apply the top, offset and limit query parameters to a report.
+    A report is sliced on its presorted positions, so only the drivers of the page
+    are ever serialized.
+    Args:
+        report (Report): The report, or a dictionary with timestamps as keys and driver information as values.
+    Returns:
+        The report of the requested page, or a list of its (time, record) pairs.
+    """
+    offset = query_int('offset', 0)
+    limit = query_int('limit')
+    if request.args.get('top', '').lower() in ('1', 'true'):
+        limit = report_racers.TOP_DELIMITER if limit is None else min(limit, report_racers.TOP_DELIMITER)
+    if offset < 0 or (limit is not None and limit < 0):
+        abort(400, description="offset and limit must not be negative")
+    stop = None if limit is None else offset + limit
+    if isinstance(report, report_racers.Report):
+        return report.slice(offset, stop)
+    if offset or stop is not None:
+        return list(islice(report_items(report), offset, stop))
+    return report
+
+
+def project_fields(page):
+    """
+    Apply the fields query parameter to a page of a report.
+    The time always stays the key of a driver.
+    Returns:
+        tuple: The (time, record) pairs projected on the requested fields and the names of those fields.
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        return page, REPORT_FIELDS
+    fields = tuple(fields.split(','))
+    unknown = set(fields) - set(REPORT_FIELDS)
+    if unknown:
+        abort(400, description=f"Unknown fields {', '.join(sorted(unknown))}, "
+                               f"the fields are {', '.join(REPORT_FIELDS)}")
+    indexes = [REPORT_FIELDS.index(field) for field in fields]
+    return ((time, tuple(record[i] for i in indexes)) for time, record in report_items(page)), fields
+
+
+def report_items(data):
+    """Returns the (time, record) pairs of a report, a dictionary or a list of pairs"""
+    return data.items() if hasattr(data, 'items') else data
+
+
+def escape(text):
+    """Escapes the text of an XML element like xml.sax.saxutils.escape, without importing the XML package"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def xml_element(tag, text):
+    """Returns an XML element with escaped text, written the way ElementTree writes it"""
+    if not isinstance(text, str):
+        text = '' if text is None else str(text)
+    if not text:
+        return f'<{tag} />'
+    return f'<{tag}>{escape(text)}</{tag}>'
 
 
 class RenderXML:
@@ -40,40 +169,347 @@ class RenderXML:
     A class for rendering race data as XML.
     This class provides methods to convert race data stored in a dictionary
     to an XML format suitable for web responses.
+    The document is written fragment by fragment instead of being built as an
+    ElementTree, and can be streamed to the client one <driver> at a time.
     """
     @staticmethod
-    def dictxml(data):
+    def iterxml(data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        """
+        Yield the XML document of race data in UTF-8 encoded fragments.
+        The fragments are byte-for-byte what ElementTree.tostring writes for the same data.
+        Args:
+            data (dict): A dictionary with timestamps as keys and tuples of driver information as values.
+                         Example: {'01:00:00': ('DRR', 'Daniel Ricardo', 'Ferrari')}
+            fields (tuple): The element names of the driver information.
+            tags (tuple): The names of the root element, of the element of a record and of its key.
+        Yields:
+            bytes: The opening tag, one <driver> element per record and the closing tag.
+        """
+        root, item, key = tags
+        empty = True
+        for time, data in report_items(data):
+            if empty:
+                yield f'<{root}>'.encode('utf-8')
+                empty = False
+            yield (
+                f'<{item}>' + xml_element(key, time) + '<data>'
+                + ''.join(map(xml_element, fields, data))
+                + f'</data></{item}>').encode('utf-8')
+        yield f'<{root} />'.encode('utf-8') if empty else f'</{root}>'.encode('utf-8')
+
+    @classmethod
+    def dictxml(cls, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
         """
         Convert a dictionary of race data to an XML string.
         This method takes a dictionary where the keys are timestamps and the values are tuples
-        containing driver information (code, name, team). It constructs an XML tree with this data.
+        containing driver information (code, name, team).
         Args:
             data (dict): A dictionary with timestamps as keys and tuples of driver information as values.
                          Example: {'01:00:00': ('DRR', 'Daniel Ricardo', 'Ferrari')}
+            fields (tuple): The element names of the driver information.
+            tags (tuple): The names of the root element, of the element of a record and of its key.
         Returns:
             bytes: An XML string representing the race data encoded in UTF-8.
         """
-        root = ET.Element('drivers')
-        for time, data in data.items():
-            driver_element = ET.SubElement(root, 'driver')
-            ET.SubElement(driver_element, 'time').text = time
-            data_element = ET.SubElement(driver_element, 'data')
-            ET.SubElement(data_element, 'code').text = data[0]
-            ET.SubElement(data_element, 'name').text = data[1]
-            ET.SubElement(data_element, 'team').text = data[2]
-        return ET.tostring(root, encoding='utf-8', method='xml')
+        return b''.join(cls.iterxml(data, fields, tags))
+
+    mimetype = 'text/xml'
+
+    def dump(self, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        return self.dictxml(data, fields, tags)
+
+    def dump_batch(self, data, missing):
+        """Writes the drivers found by a batch lookup and the codes that were not found"""
+        codes = ''.join(xml_element('code', code) for code in missing)
+        missing_xml = f'<missing>{codes}</missing>' if codes else '<missing />'
+        return b'<batch>' + self.dictxml(data) + missing_xml.encode('utf-8') + b'</batch>'
+
+    def stream(self, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        return self.iterxml(data, fields, tags)
 
     def render(self, data):
-        return Response(self.dictxml(data), mimetype='text/xml')
+        return Response(self.dump(data), mimetype=self.mimetype)
+
+
+def stdlib_json_dumps(obj):
+    """Serializes an object to compact UTF-8 JSON with the standard library encoder"""
+    return json.dumps(obj, separators=JSON_SEPARATORS, ensure_ascii=False).encode('utf-8')
+
+
+json_dumps = orjson.dumps if orjson is not None else stdlib_json_dumps
 
 
 class RenderJson:
-    @staticmethod
-    def dictjson(data):
-        return jsonify(data)
+    """
+    A class for rendering race data as JSON.
+    The encoder is pluggable through `dumps`: orjson is used when it is installed,
+    otherwise the standard library encoder writes the same bytes.
+    """
+    dumps = staticmethod(json_dumps)
+
+    @classmethod
+    def dictjson(cls, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        """
+        Convert race data to a JSON string.
+        The object is written pair by pair, so it keeps the order of the report
+        and drivers with tied lap times.
+        Args:
+            data (dict): A report or a dictionary with timestamps as keys and driver information as values.
+            fields (tuple): The names of the driver information, not written to the object.
+            tags (tuple): The XML names of the root, of a record and of its key, not written to the object.
+        Returns:
+            bytes: A JSON object representing the race data encoded in UTF-8.
+        """
+        dumps = cls.dumps
+        body = b','.join(dumps(time) + b':' + dumps(record)
+                         for time, record in report_items(data))
+        return b'{' + body + b'}\n'
+
+    mimetype = 'application/json'
+
+    def dump(self, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        return self.dictjson(data, fields, tags)
+
+    def dump_batch(self, data, missing):
+        """Writes the drivers found by a batch lookup and the codes that were not found"""
+        return (b'{"drivers":' + self.dictjson(data).rstrip(b'\n')
+                + b',"missing":' + self.dumps(missing) + b'}\n')
+
+    def render(self, data):
+        return Response(self.dump(data), mimetype=self.mimetype)
+
+
+class RenderJsonRecords(RenderJson):
+    """
+    A class for rendering race data as a JSON array of records.
+    Every driver is one object named like the NDJSON lines. Tied lap times repeat a key
+    of the object written by RenderJson, and most JSON parsers keep only the last
+    driver of a repeated key, while every record of the array reaches the client.
+    """
+
+    @classmethod
+    def dictjson(cls, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        """
+        Convert race data to a JSON array of records in the order of the report.
+        Args:
+            data (dict): A report or a dictionary with timestamps as keys and driver information as values.
+            fields (tuple): The keys of the driver information.
+            tags (tuple): The key of a record is named after the last tag.
+        Returns:
+            bytes: A JSON array like [{"time":"01:04.415000","code":"SVF","name":"Sebastian Vettel",
+                   "team":"FERRARI"}] encoded in UTF-8.
+        """
+        dumps = cls.dumps
+        key = tags[2]
+        body = b','.join(dumps({key: time, **dict(zip(fields, record))})
+                         for time, record in report_items(data))
+        return b'[' + body + b']\n'
+
+
+class RenderNDJson:
+    """
+    A class for rendering race data as newline-delimited JSON.
+    Every driver is one JSON object on its own line, which log pipelines can
+    ingest record by record. The payload is streamed as it is written.
+    """
+    dumps = staticmethod(json_dumps)
+    mimetype = 'application/x-ndjson'
+    streaming = True
+
+    @classmethod
+    def iterndjson(cls, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        """
+        Yield one UTF-8 encoded JSON line per driver.
+        Args:
+            data (dict): A report or a dictionary with timestamps as keys and driver information as values.
+            fields (tuple): The keys of the driver information.
+            tags (tuple): The key of a record is named after the last tag.
+        Yields:
+            bytes: A line like {"time":"01:04.415000","code":"SVF","name":"Sebastian Vettel","team":"FERRARI"}.
+        """
+        dumps = cls.dumps
+        key = tags[2]
+        for time, record in report_items(data):
+            line = {key: time}
+            line.update(zip(fields, record))
+            yield dumps(line) + b'\n'
+
+    def dump(self, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        return b''.join(self.iterndjson(data, fields, tags))
+
+    def stream(self, data, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
+        return self.iterndjson(data, fields, tags)
 
     def render(self, data):
-        return self.dictjson(data)
+        return Response(self.stream(data), mimetype=self.mimetype)
+
+
+class ResponseCache:
+    """
+    A cache of rendered API payloads.
+    Payloads are stored as bytes together with their strong ETag, keyed on the
+    report version and the request, so a repeated request is answered without
+    serializing the report again. The least recently used payloads are dropped
+    once the cache holds `maxsize` of them.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()
+        fork_safe.add(self)
+
+    def get(self, key):
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+            return payload
+
+    def set(self, key, payload):
+        with self._lock:
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            while len(self._payloads) > self.maxsize:
+                self._payloads.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+
+response_cache = ResponseCache()
+link_tables = ResponseCache(maxsize=64)
+
+
+def shared_response_key(key):
+    """Returns the key of a response cache entry in the shared cache, prefixed with its report version"""
+    return f'response:{key[0]}:{hashlib.sha1(repr(key[1:]).encode("utf-8")).hexdigest()}'
+
+
+def shared_backend(app):
+    """Returns the Flask-Caching backend of an app, None when the app shares no cache"""
+    backend = app.extensions.get('cache', {}).get(cache)
+    return None if backend is None or isinstance(backend, NullCache) else backend
+
+
+def cache_get(key):
+    """
+    Look up a payload in the response cache, then in the shared cache of the app.
+    A payload found in the shared cache was rendered by another worker, it is kept
+    in the response cache of this worker from then on.
+    Args:
+        key (tuple): The response cache key, the report version first.
+    Returns:
+        tuple: The body and the ETag of the payload, or None.
+    """
+    payload = response_cache.get(key)
+    backend = shared_backend(current_app)
+    if payload is None and backend is not None:
+        try:
+            payload = backend.get(shared_response_key(key))
+        except Exception as error:
+            current_app.logger.warning('The shared cache could not be read: %s', error)
+            return None
+        if payload is not None:
+            response_cache.set(key, payload)
+    return payload
+
+
+def cache_set(key, payload):
+    """Store a payload in the response cache and in the shared cache of the app"""
+    response_cache.set(key, payload)
+    backend = shared_backend(current_app)
+    if backend is not None:
+        try:
+            backend.set(shared_response_key(key), payload)
+        except Exception as error:
+            current_app.logger.warning('The shared cache could not be written: %s', error)
+
+
+def negotiate_encoding(size):
+    """
+    Choose the content encoding of a response from the Accept-Encoding header of the request.
+    Args:
+        size (int): The size of the uncompressed body.
+    Returns:
+        str: "br" or "gzip", or None when the body is sent uncompressed.
+    """
+    if size < COMPRESS_MIN_SIZE:
+        return None
+    return request.accept_encodings.best_match(compressors)
+
+
+def cached_response(dump, mimetype, version=None, format="json", stage='render'):
+    """
+    Build a response from a payload, serialized at most once per report version.
+    The payload is compressed with the best encoding the client accepts when it is
+    larger than COMPRESS_MIN_SIZE, and each compressed variant is cached next to it,
+    so it is compressed once per report version too.
+    Args:
+        dump (callable): Returns the payload as bytes.
+        mimetype (str): The mimetype of the payload.
+        version (str): The report version the payload is built from, the payload is
+                       cached for the request unless it is None.
+        format (str): The format of the payload.
+        stage (str): The instrumentation stage the serialization is timed as.
+    Returns:
+        Response: A Flask Response object with a strong ETag, or 304 Not Modified.
+    """
+    key = None
+    payload = None
+    if version is not None:
+        key = (version, format, request.host_url, request.path,
+               tuple(sorted(request.args.items(multi=True))))
+        payload = cache_get(key)
+    if payload is None:
+        with instrumentation.stage(stage):
+            body = dump()
+        payload = body, hashlib.sha1(body).hexdigest()
+        if key is not None:
+            cache_set(key, payload)
+    encoding = negotiate_encoding(len(payload[0]))
+    if encoding is not None:
+        variant = cache_get(key + (encoding,)) if key is not None else None
+        if variant is None:
+            body, etag = payload
+            with instrumentation.stage('compress'):
+                variant = compressors[encoding](body), f'{etag}-{encoding}'
+            if key is not None:
+                cache_set(key + (encoding,), variant)
+        payload = variant
+    body, etag = payload
+    response = Response(body, mimetype=mimetype)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+def driver_links(report, endpoint, external=False, **values):
+    """
+    Return the table of driver codes to URLs of an endpoint.
+    The table of a versioned report is built once per version, scheme and host and then
+    shared by every request, instead of building a URL per row per request.
+    Args:
+        report (dict): The report whose drivers are linked.
+        endpoint (str): The endpoint of the driver page, taking the code as `name`.
+        external (bool): Whether to build absolute URLs.
+        **values: Other arguments of the endpoint, such as the race id.
+    Returns:
+        dict: The URL of every driver code in the report.
+    """
+    version = getattr(report, 'version', None)
+    key = (version, request.host_url, endpoint, external,
+           tuple(sorted(values.items())))
+    links = link_tables.get(key) if version is not None else None
+    if links is None:
+        links = {record[0]: url_for(endpoint, name=record[0], _external=external, **values)
+                 for record in report.values()}
+        if version is not None:
+            link_tables.set(key, links)
+    return links
 
 
 class RenderMixin:
@@ -85,18 +521,30 @@ class RenderMixin:
     """
     renders = {
         "json": RenderJson,
-        "xml": RenderXML
+        "records": RenderJsonRecords,
+        "xml": RenderXML,
+        "ndjson": RenderNDJson
     }
 
-    def render(self, data, format="json"):
+    def render(self, data, format="json", version=None, fields=REPORT_FIELDS, tags=DRIVER_TAGS):
         """
         Render data in the specified format.
         This method takes data and a format name, retrieves the corresponding rendering class
         from the `renders` dictionary, and uses it to render the data. If the specified format
         is not supported, it raises a ValueError.
+        Streaming renderers, and any renderer that supports streaming when the `stream=1`
+        query parameter is given, send the payload in fragments as it is written,
+        without caching it.
+        Payloads of a versioned report are kept in the response cache, keyed on the version
+        and the request, and every response carries a strong ETag, so a request with a
+        matching If-None-Match header is answered with 304 Not Modified.
         Args:
             data (dict): The data to be rendered.
             format (str): The format in which to render the data. Default is "json".
+            version (str): The report version the data was built from. Defaults to the
+                           `version` of the data, unversioned data is not cached.
+            fields (tuple): The names of the driver information in the data.
+            tags (tuple): The XML names of the root, of a record and of its key.
         Returns:
             Response: A Flask Response object containing the rendered data.
         Raises:
@@ -107,7 +555,12 @@ class RenderMixin:
             raise ValueError(
                 f"Format does not support. Support formats are {
                     self.renders}")
-        return render_().render(data)
+        streaming = getattr(render_, 'streaming', False) or request.args.get('stream') == '1'
+        if streaming and hasattr(render_, 'stream'):
+            return Response(render_().stream(data, fields, tags), mimetype=render_.mimetype)
+        if version is None:
+            version = getattr(data, 'version', None)
+        return cached_response(lambda: render_().dump(data, fields, tags), render_.mimetype, version, format)
 
 
 class IndexApi(Resource, RenderMixin):
@@ -122,7 +575,7 @@ class IndexApi(Resource, RenderMixin):
         RenderMixin: Mixin class providing rendering capabilities in multiple formats.
     """
 
-    def get(self):
+    def get(self, race_id=None):
         """
         This route handles the main page.
         ---
@@ -132,15 +585,70 @@ class IndexApi(Resource, RenderMixin):
             type: string
             default: asc
             description: The order of sorting (asc or desc).
+          - name: format
+            in: query
+            type: string
+            default: json
+            enum: [json, records, xml, ndjson]
+            description: The format of the response, records is JSON with an object per driver.
+          - name: offset
+            in: query
+            type: integer
+            default: 0
+            description: The number of drivers to skip.
+          - name: limit
+            in: query
+            type: integer
+            description: The maximum number of drivers to return.
+          - name: top
+            in: query
+            type: boolean
+            description: Return only the top 15 drivers.
+          - name: fields
+            in: query
+            type: string
+            description: A comma separated list of the driver fields to return (code, name, team).
         responses:
           200:
             description: This route retrieves race report data, sorts it according to the specified order,
-        and returns it in the specified format (default is JSON).
+              and returns it in the specified format (default is JSON).
         """
-        order = request.args.get('order', 'asc')
+        return self.render_report(load_report(request.args.get('order', 'asc'), race_id), race_id)
+
+    def render_report(self, sorted_data, race_id=None):
+        """Renders the requested page of a loaded report, the ASGI entry point loads it in a worker thread"""
         format_param = request.args.get('format', 'json')
-        sorted_data = report_racers.build_report(order)
-        return self.render(sorted_data, format_param)
+        page, fields = project_fields(report_page(sorted_data))
+        return self.render(page, format_param, getattr(sorted_data, 'version', None), fields)
+
+
+class LeaderboardStream(Resource):
+    """
+    API resource streaming live leaderboard updates.
+    This class handles GET requests with a Server-Sent Events stream: the whole
+    leaderboard is sent first, then only the positions that changed whenever the
+    data files change. All subscribers are fed by one watcher through the hub.
+    Inherits from:
+        Resource: Base class for all Flask-RESTful resources.
+    """
+
+    def get(self):
+        """
+        Streams leaderboard updates as Server-Sent Events.
+        ---
+        produces:
+          - text/event-stream
+        responses:
+          200:
+            description: A stream of leaderboard events. Each event holds the report version,
+              the size of the leaderboard and the changed positions with their time, code, name and team.
+        """
+        leaderboard_hub.ensure_watching()
+        subscriber = leaderboard_hub.subscribe(leaderboard.QueueSubscriber())
+        return Response(
+            leaderboard_hub.stream(subscriber),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 class InfoDriver(Resource, RenderMixin):
@@ -153,7 +661,7 @@ class InfoDriver(Resource, RenderMixin):
         RenderMixin: Mixin class providing rendering capabilities in multiple formats.
     """
 
-    def get(self):
+    def get(self, race_id=None):
         """
         Shows a list of driver's names and codes. The code should be a link to info about drivers.
         ---
@@ -163,23 +671,45 @@ class InfoDriver(Resource, RenderMixin):
             type: string
             default: asc
             description: The order of sorting (asc or desc).
+          - name: format
+            in: query
+            type: string
+            default: json
+            enum: [json, records, xml, ndjson]
+            description: The format of the response, records is JSON with an object per driver.
+          - name: offset
+            in: query
+            type: integer
+            default: 0
+            description: The number of drivers to skip.
+          - name: limit
+            in: query
+            type: integer
+            description: The maximum number of drivers to return.
+          - name: top
+            in: query
+            type: boolean
+            description: Return only the top 15 drivers.
+          - name: fields
+            in: query
+            type: string
+            description: A comma separated list of the driver fields to return (code, name, team).
         responses:
           200:
             description: This route retrieves driver information, sorts it according to the specified order,
-        and returns it in the specified format (default is JSON).
+              and returns it in the specified format (default is JSON).
         """
-        order = request.args.get('order', 'asc')
+        return self.render_report(load_report(request.args.get('order', 'asc'), race_id), race_id)
+
+    def render_report(self, sorted_data, race_id=None):
+        """Renders the linked drivers of a loaded report, the ASGI entry point loads it in a worker thread"""
         format_param = request.args.get('format', 'json')
-        sorted_data_info = report_racers.build_report(order)
-        for time, race_result in sorted_data_info.items():
-            sorted_data_info[time] = (
-                url_for(
-                    'namepage',
-                    name=race_result[0],
-                    _external=True),
-                race_result[1],
-                race_result[2])
-        return self.render(sorted_data_info, format_param)
+        links = driver_links(sorted_data, 'namepage', external=True, race_id=race_id)
+        sorted_data_info = (
+            (time, (links[race_result[0]], race_result[1], race_result[2]))
+            for time, race_result in report_items(report_page(sorted_data)))
+        page, fields = project_fields(sorted_data_info)
+        return self.render(page, format_param, getattr(sorted_data, 'version', None), fields)
 
 
 class NamePage(Resource, RenderMixin):
@@ -191,7 +721,7 @@ class NamePage(Resource, RenderMixin):
         RenderMixin: Mixin class providing rendering capabilities in multiple formats.
     """
 
-    def get(self, name):
+    def get(self, name, race_id=None):
         """
         Returns a page with the name.
         It returns the main report in HTML format.
@@ -207,20 +737,361 @@ class NamePage(Resource, RenderMixin):
             type: string
             default: asc
             description: The order of sorting (asc or desc).
+          - name: format
+            in: query
+            type: string
+            default: json
+            enum: [json, records, xml, ndjson]
+            description: The format of the response, records is JSON with an object per driver.
         responses:
           200:
             description: The format of the response (json or xml).
         """
-        order = request.args.get('order', 'asc')
+        return self.render_report(load_report(request.args.get('order', 'asc'), race_id), name, race_id)
+
+    def render_report(self, sorted_data, name, race_id=None):
+        """Renders a driver of a loaded report, the ASGI entry point loads it in a worker thread"""
         format_param = request.args.get('format', 'json')
-        sorted_data = report_racers.build_report(order)
         page = report_racers.get_racer_data(sorted_data, name)
+        if not page:
+            abort(404, description=f"Driver {name} not found")
         return self.render(page, format_param)
 
 
-api.add_resource(InfoDriver, '/api/v1/report/drivers/')
-api.add_resource(IndexApi, '/api/v1/report/')
-api.add_resource(NamePage, '/api/v1/report/drivers/<name>/')
+class DriverBatch(Resource, RenderMixin):
+    """
+    API resource looking up several drivers at once.
+    All codes are looked up in one report snapshot, so a page showing a handful of
+    drivers needs one request instead of one per driver.
+    Inherits from:
+        Resource: Base class for all Flask-RESTful resources.
+        RenderMixin: Mixin class providing rendering capabilities in multiple formats.
+    """
+    batch_renders = {
+        "json": RenderJson,
+        "records": RenderJsonRecords,
+        "xml": RenderXML
+    }
+
+    def get(self, race_id=None):
+        """
+        Returns the drivers with the given codes.
+        ---
+        parameters:
+          - name: codes
+            in: query
+            type: string
+            required: true
+            description: A comma separated list of driver codes, e.g. SVF,LHM,VBM.
+          - name: order
+            in: query
+            type: string
+            default: asc
+            description: The order of sorting (asc or desc).
+          - name: format
+            in: query
+            type: string
+            default: json
+            enum: [json, records, xml]
+            description: The format of the response, records is JSON with an object per driver.
+        responses:
+          200:
+            description: The records of the drivers that were found, in report order,
+              and the codes that were not found.
+        """
+        codes = [code for value in request.args.getlist('codes') for code in value.split(',') if code]
+        return self.lookup(codes, race_id, cacheable=True)
+
+    def post(self, race_id=None):
+        """
+        Returns the drivers with the codes of a JSON body.
+        ---
+        parameters:
+          - name: body
+            in: body
+            required: true
+            schema:
+              type: object
+              properties:
+                codes:
+                  type: array
+                  items:
+                    type: string
+            description: 'The driver codes, e.g. {"codes": ["SVF", "LHM"]}.'
+          - name: order
+            in: query
+            type: string
+            default: asc
+            description: The order of sorting (asc or desc).
+          - name: format
+            in: query
+            type: string
+            default: json
+            enum: [json, records, xml]
+            description: The format of the response, records is JSON with an object per driver.
+        responses:
+          200:
+            description: The records of the drivers that were found, in report order,
+              and the codes that were not found.
+        """
+        body = request.get_json(silent=True)
+        codes = body.get('codes') if isinstance(body, dict) else None
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            abort(400, description='The body must be a JSON object like {"codes": ["SVF", "LHM"]}')
+        return self.lookup(codes, race_id, cacheable=False)
+
+    def lookup(self, codes, race_id, cacheable):
+        if not codes:
+            abort(400, description="No driver codes given")
+        if len(codes) > MAX_BATCH_CODES:
+            abort(400, description=f"At most {MAX_BATCH_CODES} driver codes can be looked up at once")
+        format_param = request.args.get('format', 'json')
+        render_ = self.batch_renders.get(format_param)
+        if not render_:
+            abort(400, description=f"Batch lookups support the formats {', '.join(self.batch_renders)}")
+        order = request.args.get('order', 'asc')
+        sorted_data = load_report(order, race_id)
+        found, missing = report_racers.get_racers_data(sorted_data, codes)
+        version = getattr(sorted_data, 'version', None) if cacheable else None
+        return cached_response(lambda: render_().dump_batch(found, missing), render_.mimetype, version, format_param)
+
+
+def analytics_report(order, race_id=None):
+    """Returns the report analytics are computed on, they need the lap table of a built report"""
+    sorted_data = load_report(order, race_id)
+    if not isinstance(sorted_data, report_racers.Report):
+        abort(404, description="No analytics for this report")
+    return sorted_data
+
+
+class TeamStandings(Resource, RenderMixin):
+    """
+    API resource for the team standings.
+    The standings are computed with the other analytics of the race in one pass when
+    the report is built, and cached with it, so a request only renders them.
+    Inherits from:
+        Resource: Base class for all Flask-RESTful resources.
+        RenderMixin: Mixin class providing rendering capabilities in multiple formats.
+    """
+
+    def get(self, race_id=None):
+        """
+        Returns the teams ranked by the best lap of their drivers.
+        ---
+        parameters:
+          - name: order
+            in: query
+            type: string
+            default: asc
+            description: The order of sorting (asc or desc).
+          - name: format
+            in: query
+            type: string
+            default: json
+            enum: [json, records, xml, ndjson]
+            description: The format of the response, records is JSON with an object per driver.
+        responses:
+          200:
+            description: The position, best lap time, code of the fastest driver, number of drivers
+              and mean lap time of every team.
+        """
+        order = request.args.get('order', 'asc')
+        format_param = request.args.get('format', 'json')
+        sorted_data = analytics_report(order, race_id)
+        return self.render(list(sorted_data.teams()), format_param, sorted_data.version, TEAM_FIELDS, TEAM_TAGS)
+
+
+class DriverGaps(Resource, RenderMixin):
+    """
+    API resource for the gaps between the drivers.
+    Every driver comes with the gap to the leader, the interval to the car ahead, the
+    share of the field with a faster lap and the percentile band of the lap, all
+    computed once per version of the data files.
+    Inherits from:
+        Resource: Base class for all Flask-RESTful resources.
+        RenderMixin: Mixin class providing rendering capabilities in multiple formats.
+    """
+
+    def get(self, race_id=None):
+        """
+        Returns the gap to the leader and the interval to the car ahead of every driver.
+        ---
+        parameters:
+          - name: order
+            in: query
+            type: string
+            default: asc
+            description: The order of sorting (asc or desc).
+          - name: format
+            in: query
+            type: string
+            default: json
+            enum: [json, records, xml, ndjson]
+            description: The format of the response, records is JSON with an object per driver.
+          - name: offset
+            in: query
+            type: integer
+            default: 0
+            description: The number of drivers to skip.
+          - name: limit
+            in: query
+            type: integer
+            description: The maximum number of drivers to return.
+        responses:
+          200:
+            description: The code, name, team, gap, interval, percentile and band of every driver,
+              with the lap time.
+        """
+        order = request.args.get('order', 'asc')
+        format_param = request.args.get('format', 'json')
+        sorted_data = analytics_report(order, race_id)
+        return self.render(report_page(sorted_data).gaps(), format_param, sorted_data.version, GAP_FIELDS)
+
+
+class RaceList(Resource):
+    """
+    API resource listing the races of the catalog.
+    Inherits from:
+        Resource: Base class for all Flask-RESTful resources.
+    """
+
+    def get(self):
+        """
+        Lists the ids of the races that can be used in the /api/v1/races/<race_id>/report/ routes.
+        ---
+        responses:
+          200:
+            description: The ids of the races found under the data root.
+        """
+        return {'races': report_racers.race_catalog.races()}
+
+
+api.add_resource(InfoDriver, '/api/v1/report/drivers/', '/api/v1/races/<race_id>/report/drivers/')
+api.add_resource(IndexApi, '/api/v1/report/', '/api/v1/races/<race_id>/report/')
+api.add_resource(LeaderboardStream, '/api/v1/report/stream/')
+api.add_resource(NamePage, '/api/v1/report/drivers/<name>/', '/api/v1/races/<race_id>/report/drivers/<name>/')
+api.add_resource(DriverBatch, '/api/v1/report/drivers/batch/', '/api/v1/races/<race_id>/report/drivers/batch/')
+api.add_resource(TeamStandings, '/api/v1/report/teams/', '/api/v1/races/<race_id>/report/teams/')
+api.add_resource(DriverGaps, '/api/v1/report/gaps/', '/api/v1/races/<race_id>/report/gaps/')
+api.add_resource(RaceList, '/api/v1/races/')
+
+
+class LazySwagger:
+    """
+    WSGI middleware serving the Swagger UI and spec from a docs app built on first use.
+    flasgger and the YAML parsing of the resource docstrings stay off the startup path
+    of every worker until the docs are requested.
+    """
+    prefixes = ('/apidocs', '/apispec_1.json', '/flasgger_static')
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.docs_app = None
+        self._lock = threading.Lock()
+        fork_safe.add(self)
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(self.prefixes):
+            return self.docs()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def docs(self):
+        with self._lock:
+            if self.docs_app is None:
+                from flasgger import Swagger
+                self.docs_app = register_routes(Flask(__name__))
+                Swagger(self.docs_app)
+        return self.docs_app
+
+
+def after_fork():
+    """Renews the locks of the response caches and of the docs middleware in a forked worker,
+    a lock held by a thread of the parent at the fork would never be released in the child"""
+    for owner in fork_safe:
+        owner._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+
+def register_routes(app):
+    """Registers the HTML pages and the API resources on an app. returns the app"""
+    app.add_url_rule('/report', view_func=index, defaults={'race_id': None})
+    app.add_url_rule('/races/<race_id>/report', view_func=index)
+    app.add_url_rule('/report/drivers/', view_func=info_in_drivers, defaults={'race_id': None})
+    app.add_url_rule('/races/<race_id>/report/drivers/', view_func=info_in_drivers)
+    app.add_url_rule('/report/drivers/<name>', view_func=name_page, defaults={'race_id': None})
+    app.add_url_rule('/races/<race_id>/report/drivers/<name>', view_func=name_page)
+    api.init_app(app)
+    return app
+
+
+def cache_config(config=None):
+    """
+    Build the Flask-Caching configuration from the CACHE_* environment variables.
+    The default NullCache keeps reports and payloads in each worker only, SimpleCache
+    is a stand-in local to the process, FileSystemCache (with CACHE_DIR) and RedisCache
+    (with CACHE_REDIS_URL) are shared by all the workers using them. RedisCache needs the
+    redis client, which requirements.txt pins and the redis extra of setup.py installs.
+    Args:
+        config (dict): Settings overriding the environment.
+    Returns:
+        dict: The configuration.
+    """
+    settings = {'CACHE_TYPE': 'NullCache', 'CACHE_DEFAULT_TIMEOUT': 3600}
+    settings.update((key, os.environ[key]) for key in CACHE_CONFIG_KEYS if key in os.environ)
+    settings.update(config or {})
+    for key in ('CACHE_DEFAULT_TIMEOUT', 'CACHE_THRESHOLD'):
+        if key in settings:
+            settings[key] = int(settings[key])
+    return settings
+
+
+def watch_reports():
+    """
+    Apply the REPORT_LIVE and REPORT_REFRESH_INTERVAL settings to the report cache of report_racers.
+    REPORT_LIVE=1 ingests only the lines appended to the logs, and REPORT_REFRESH_INTERVAL starts
+    the refresher rebuilding the report in a background thread. The refresher is started once
+    per process, however many apps are created.
+    """
+    if os.environ.get('REPORT_LIVE', '') not in ('', '0'):
+        report_racers.report_cache.follow()
+    refresher = report_racers.refresher
+    if os.environ.get('REPORT_REFRESH_INTERVAL') and (refresher is None or not refresher.is_alive()):
+        report_racers.start_refresher(float(os.environ['REPORT_REFRESH_INTERVAL']))
+
+
+def create_app(preload=False, config=None, share_reports=False):
+    """
+    Create the Flask application.
+    The HTML pages and the API resources are registered on a new app, the Swagger docs
+    are built on their first request. Rendered payloads are shared through the
+    Flask-Caching backend of the app. All apps share the report cache of report_racers,
+    which is process-wide, so only the entry point of a server asks for its lap tables
+    to be stored in the backend too, once at startup.
+    Keys are versioned by the fingerprint of the data files, so the workers of a node
+    pointed at one filesystem or Redis cache share its entries without invalidating them.
+    The REPORT_LIVE and REPORT_REFRESH_INTERVAL settings are applied here, see watch_reports.
+    Args:
+        preload (bool): Parse the race data and build the report indexes before returning,
+                        so workers forked from a preloading server share them copy-on-write.
+        config (dict): Flask-Caching settings overriding the CACHE_* environment variables.
+        share_reports (bool): Store the lap tables of the report cache in the backend of this app.
+    Returns:
+        Flask: The application.
+    """
+    app = register_routes(Flask(__name__))
+    app.wsgi_app = LazySwagger(app.wsgi_app)
+    cache.init_app(app, config=cache_config(config))
+    if share_reports:
+        report_racers.share_cache(shared_backend(app))
+    instrumentation.init_app(app)
+    watch_reports()
+    if preload:
+        report_racers.preload()
+    return app
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -1,15 +1,45 @@
+import gc
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from functools import cached_property
 from pathlib import Path
+from typing import Iterator
 from datetime import datetime
 from datetime import timedelta
 
+import instrumentation
+
 ROOT = Path(__file__).resolve().parent
 DATA_DIR = ROOT / "data"
 ABBR_FILE = DATA_DIR / "abbreviations.txt"
 STARTLOG_FILE = DATA_DIR / "start.log"
 ENDLOG_FILE = DATA_DIR / "end.log"
+SNAPSHOT_FILE = DATA_DIR / "report.snap"
+RACES_DIR = Path(os.environ.get('RACES_DIR', DATA_DIR))
 DATETIME_FORMAT = '%Y-%m-%d_%H:%M:%S.%f'
 STRTIME_FORMAT = '%M:%S.%f'
 TOP_DELIMITER = 15
+MICROSECOND = timedelta(microseconds=1)
+SNAPSHOT_MAGIC = b'RRSN'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHHII16s')
+# a code and a timestamp with milliseconds or microseconds, like SVF2018-05-24_12:02:58.917
+RACE_LINE_WIDTHS = (26, 29)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
 
 
 def read_data_file(file_path: Path) -> list:
@@ -20,21 +50,62 @@ def read_data_file(file_path: Path) -> list:
         return content
 
 
-def parse_race_file(file: Path) -> dict[str, datetime]:
+def iter_data_file(file_path: Path) -> Iterator[str]:
+    """This function reads a data file line by line, so only a buffered chunk
+         of the file is held in memory however large the file is"""
+    with open(file_path, 'r') as fp:
+        for line in fp:
+            yield line.rstrip('\n')
+
+
+def parse_timestamp(value: str) -> datetime:
+    """This function parses a time in DATETIME_FORMAT. Values of the fixed-width
+         shape are handed to the C-level ISO parser, which slices the fields
+         straight into integers; any other shape goes through strptime"""
+    if (len(value) in (23, 26) and value[10] == '_' and value[19] == '.'
+            and value[20:].isdigit()):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return datetime.strptime(value, DATETIME_FORMAT)
+
+
+def parse_race_line(line: str) -> tuple[str, datetime]:
+    """This function parses one line of a race file into the racer's initials
+         and the time, it raises ValueError for a malformed line"""
+    return line[:3].strip(), parse_timestamp(line[3:].strip())
+
+
+def iter_race_lines(lines, source, errors: list | None = None) -> Iterator[tuple[str, datetime]]:
+    """This function lazily parses numbered lines of a race file. yields the racer's
+         initials and the time, blank and malformed lines are skipped and reported to errors"""
+    for line_number, line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield parse_race_line(line)
+        except ValueError:
+            logger.warning('%s:%d: skipped malformed line %r', source, line_number, line)
+            if errors is not None:
+                errors.append((str(source), line_number, line))
+
+
+def iter_race_file(file: Path, errors: list | None = None) -> Iterator[tuple[str, datetime]]:
+    """This function lazily parses race data from a file. yields the racer's initials
+         and the time, blank and malformed lines are skipped and reported to errors"""
+    return iter_race_lines(enumerate(iter_data_file(file), start=1), file, errors)
+
+
+@instrumentation.timed('parse_race_file')
+def parse_race_file(file: Path, errors: list | None = None) -> dict[str, datetime]:
     """This function parses race data from a file. returns a dictionary,
          where the key is the racer's initials and the value is the time"""
-    race_data = dict()
-    result_time = read_data_file(file)
-    for line in result_time:
-        if not line:
-            break
-        driver = line[:3].strip()
-        date_time = line[3:].strip()
-        date_time = datetime.strptime(date_time, DATETIME_FORMAT)
-        race_data[driver] = date_time
-    return race_data
+    return dict(iter_race_file(file, errors))
 
 
+@instrumentation.timed('parser_drivers')
 def parser_drivers(file: Path) -> dict[str, list]:
     """This function parses data about riders from a file. returns a dictionary in which
          the key is the driver's initials and the value is the driver's name and team name"""
@@ -48,23 +119,897 @@ def parser_drivers(file: Path) -> dict[str, list]:
     return drivers_data
 
 
+def format_lap_time(duration: int) -> str:
+    """This function formats a lap duration in microseconds as STRTIME_FORMAT does"""
+    minutes, microseconds = divmod(duration, 60_000_000)
+    seconds, microseconds = divmod(microseconds, 1_000_000)
+    return f'{minutes % 60:02d}:{seconds:02d}.{microseconds:06d}'
+
+
+def descending_positions(keys) -> array:
+    """This function returns the positions of ascending keys from the largest key to the
+         smallest. Equal keys keep their ascending order, so tied laps stay in code order
+         in both directions"""
+    positions = array('q')
+    end = len(keys)
+    while end:
+        start = end - 1
+        while start and keys[start - 1] == keys[end - 1]:
+            start -= 1
+        positions.extend(range(start, end))
+        end = start
+    return positions
+
+
+class LapTable:
+    """Columnar lap results ranked by duration. Codes, names and teams are interned
+    once and durations are kept in an array('q') of microseconds, so a table costs
+    a few machine words per racer instead of a dictionary entry and a tuple.
+    A table read from a binary snapshot keeps its durations in the memory-mapped
+    file instead."""
+
+    def __init__(self, codes=(), names=(), teams=(), durations=(), version=None):
+        self.version = version
+        self.codes = [sys.intern(code) for code in codes]
+        self.names = [sys.intern(name) for name in names]
+        self.teams = [sys.intern(team) for team in teams]
+        self.durations = durations if isinstance(durations, memoryview) else array('q', durations)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'LapTable':
+        """Builds a table from (duration, code, name, team) rows, ranking them
+        by duration with the racer's code breaking ties"""
+        rows = sorted(rows)
+        durations, codes, names, teams = zip(*rows) if rows else ((), (), (), ())
+        return cls(codes, names, teams, durations)
+
+    @cached_property
+    def times(self) -> list[str]:
+        return [format_lap_time(duration) for duration in self.durations]
+
+    @cached_property
+    def analytics(self) -> 'RaceAnalytics':
+        return RaceAnalytics(self)
+
+    @cached_property
+    def descending(self) -> array:
+        """The positions of the table from the slowest lap to the fastest, ties in code order"""
+        return descending_positions(self.durations)
+
+    def record(self, i) -> tuple[str, str, str]:
+        return self.codes[i], self.names[i], self.teams[i]
+
+    def nbytes(self) -> int:
+        """Returns an estimate of the memory held by the table"""
+        strings = set(self.codes) | set(self.names) | set(self.teams)
+        columns = (self.codes, self.names, self.teams, self.durations)
+        if 'times' in self.__dict__:
+            strings.update(self.times)
+            columns += (self.times,)
+        if 'descending' in self.__dict__:
+            columns += (self.descending,)
+        size = sum(map(sys.getsizeof, strings)) + sum(map(sys.getsizeof, columns))
+        if 'analytics' in self.__dict__:
+            size += self.analytics.nbytes()
+        return size
+
+    def __len__(self):
+        return len(self.durations)
+
+
+class RaceAnalytics:
+    """Gaps, percentiles and team standings of a lap table, computed in one pass
+    over its ranked durations. The analytics are cached on the table, so they are
+    built once per version of the data files and shared by both report orders.
+    Durations are in microseconds, a percentile is the share of the field with a
+    strictly faster lap and a band is the first of BANDS whose lap time the lap is within,
+    stored as an index into BAND_NAMES."""
+    BANDS = (10, 25, 50, 75, 90, 100)
+    BAND_NAMES = tuple(f'p{band}' for band in BANDS)
+
+    def __init__(self, table: LapTable):
+        durations = table.durations
+        count = len(durations)
+        leader = durations[0] if count else 0
+        self.gaps = array('q')
+        self.intervals = array('q')
+        self.percentiles = array('d')
+        self.bands = array('B')
+        # the lap time at the rank of each band, the rank rounded up as in the nearest-rank method
+        self.band_limits = [durations[max(0, -(-band * count // 100) - 1)]
+                            for band in self.BANDS] if count else []
+        teams = dict()
+        previous = leader
+        faster = 0
+        band = 0
+        for position, duration in enumerate(durations):
+            if duration != previous:
+                faster = position
+            while duration > self.band_limits[band]:
+                band += 1
+            self.gaps.append(duration - leader)
+            self.intervals.append(duration - previous)
+            self.percentiles.append(round(100 * faster / count, 1))
+            self.bands.append(band)
+            previous = duration
+            standing = teams.get(table.teams[position])
+            if standing is None:
+                teams[table.teams[position]] = [position, 1, duration]
+            else:
+                standing[1] += 1
+                standing[2] += duration
+        self.teams = [(team, best, drivers, total // drivers)
+                      for team, (best, drivers, total) in teams.items()]
+
+    def nbytes(self) -> int:
+        return (sys.getsizeof(self.gaps) + sys.getsizeof(self.intervals) + sys.getsizeof(self.percentiles)
+                + sys.getsizeof(self.bands) + sys.getsizeof(self.teams) + sum(map(sys.getsizeof, self.teams)))
+
+
+def rank_laps(start: dict, end: dict, abbr: dict) -> LapTable:
+    """This function computes lap durations in integer microseconds and ranks them.
+         returns a table sorted once by duration, the racer's code breaks ties
+         so no racer overwrites another"""
+    rows = []
+    for code, st_time in start.items():
+        end_time = end.get(code)
+        if end_time is None:
+            logger.warning('%s has a start time but no finish time', code)
+            continue
+        duration = abs(end_time - st_time) // MICROSECOND
+        name, team = (list(abbr.get(code, ())) + ['', ''])[:2]
+        rows.append((duration, code, name, team))
+    return LapTable.from_rows(rows)
+
+
+class DriverIndex:
+    """An index over the records of a report, so a driver is found in O(1)
+    by code, by exact name or by team instead of scanning the whole report.
+    Lookups return positions of the matching records in the report order."""
+
+    def __init__(self, report):
+        self.by_code = dict()
+        self.by_name = dict()
+        self.by_team = dict()
+        for position, (_time, record) in enumerate(report.items()):
+            fields = tuple(record) + (None, None, None)
+            code, name, team = fields[:3]
+            self.by_code.setdefault(code, position)
+            self.by_name.setdefault(name, position)
+            self.by_team.setdefault(team, []).append(position)
+
+    def lookup(self, name) -> list[int]:
+        """Returns the positions matching the code, the name or the team, in that priority"""
+        if name in self.by_code:
+            return [self.by_code[name]]
+        if name in self.by_name:
+            return [self.by_name[name]]
+        return self.by_team.get(name, [])
+
+    def nbytes(self) -> int:
+        """Returns an estimate of the memory held by the index, the codes, names and teams
+        it is keyed on are the strings of the lap table"""
+        return (sum(map(sys.getsizeof, (self.by_code, self.by_name, self.by_team)))
+                + sum(map(sys.getsizeof, self.by_team.values()))
+                + sum(map(sys.getsizeof, self.by_code.values())))
+
+
+class Report:
+    """Lap results of one version of the data files, a view over a ranked lap table.
+    The table is shared between the asc and desc reports and with the requests
+    reading them through the report cache, so a report must not be modified.
+    A report iterates like the dictionary the templates and renderers expect:
+    items() yields the formatted lap time and the (code, name, team) record,
+    tied lap times included."""
+
+    def __init__(self, table: LapTable, order='asc', positions=None):
+        self.table = table
+        self.order = order
+        if positions is None:
+            positions = table.descending if order == 'desc' else range(len(table))
+        self.positions = positions
+
+    @property
+    def version(self):
+        """The version of the data files the report was built from"""
+        return self.table.version
+
+    @cached_property
+    def index(self) -> DriverIndex:
+        return DriverIndex(self)
+
+    def subset(self, positions) -> 'Report':
+        """Returns a report of the records at the given positions of this report"""
+        return Report(self.table, self.order, array('q', [self.positions[i] for i in positions]))
+
+    def slice(self, start: int, stop: int | None = None) -> 'Report':
+        """Returns a report of the records from start to stop, without copying the table"""
+        return Report(self.table, self.order, self.positions[start:stop])
+
+    def head(self, count: int = TOP_DELIMITER) -> 'Report':
+        """Returns a report of the first count records"""
+        return self.slice(0, count)
+
+    def by_team(self, team: str) -> 'Report':
+        """Returns a report of the records of one team"""
+        teams = self.table.teams
+        return Report(self.table, self.order,
+                      array('q', [i for i in self.positions if teams[i] == team]))
+
+    def gaps(self):
+        """Yields the lap time and the (code, name, team, gap to the leader, interval to the car
+        ahead, percentile, band) of every record, the gaps are formatted like lap times"""
+        table = self.table
+        analytics = table.analytics
+        times, gaps, intervals = table.times, analytics.gaps, analytics.intervals
+        percentiles, bands, names = analytics.percentiles, analytics.bands, analytics.BAND_NAMES
+        for i in self.positions:
+            yield times[i], (table.codes[i], table.names[i], table.teams[i], format_lap_time(gaps[i]),
+                             format_lap_time(intervals[i]), percentiles[i], names[bands[i]])
+
+    def teams(self):
+        """Yields the name and the (position, best lap time, code of the fastest driver, number of
+        drivers, mean lap time) of every team, ranked by the best lap of the team"""
+        table = self.table
+        standings = table.analytics.teams
+        if self.order == 'desc':
+            best_durations = [table.durations[best] for _, best, _, _ in standings]
+            standings = [standings[i] for i in descending_positions(best_durations)]
+        for team, best, drivers, mean in standings:
+            yield team, (best + 1, table.times[best], table.codes[best], drivers, format_lap_time(mean))
+
+    def items(self):
+        times, codes, names, teams = self.table.times, self.table.codes, self.table.names, self.table.teams
+        for i in self.positions:
+            yield times[i], (codes[i], names[i], teams[i])
+
+    def keys(self):
+        times = self.table.times
+        return (times[i] for i in self.positions)
+
+    def values(self):
+        return (self.table.record(i) for i in self.positions)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return NotImplemented
+        return list(self.items()) == [(lap_time, tuple(record)) for lap_time, record in other.items()]
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Report({dict(self.items())!r})'
+
+
+class LogTail:
+    """Follows an append-only race log from the offset read last time. Only complete
+    lines are handed out, the unterminated rest of the file is kept in `pending`
+    until its newline arrives or the file settles.
+    The last bytes read are compared again before every read, so a file that
+    was truncated, rotated or rewritten is reported instead of being mixed up
+    with an append."""
+
+    CHECK_BYTES = 64
+    SETTLE_SECONDS = 2.0
+
+    def __init__(self, path: Path, chunk_size: int = 1 << 16):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        """Forgets everything read, the next read starts from the top of the file"""
+        self.offset = 0
+        self.line_number = 0
+        self.identity = None
+        self.mtime = None
+        self.pending = b''
+        self.last_bytes = b''
+
+    def is_appended(self) -> bool:
+        """Returns False when the file no longer continues what was read so far"""
+        if not self.offset:
+            return True
+        stat = os.stat(self.path)
+        if (stat.st_dev, stat.st_ino) != self.identity or stat.st_size < self.offset:
+            return False
+        if stat.st_size == self.offset:
+            return stat.st_mtime_ns == self.mtime
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.offset - len(self.last_bytes))
+            return fp.read(len(self.last_bytes)) == self.last_bytes
+
+    def read_lines(self) -> Iterator[tuple[int, str]]:
+        """Yields the numbered complete lines appended since the last read"""
+        with open(self.path, 'rb') as fp:
+            stat = os.fstat(fp.fileno())
+            self.identity = (stat.st_dev, stat.st_ino)
+            self.mtime = stat.st_mtime_ns
+            fp.seek(self.offset)
+            while chunk := fp.read(self.chunk_size):
+                self.offset += len(chunk)
+                self.last_bytes = (self.last_bytes + chunk)[-self.CHECK_BYTES:]
+                lines = (self.pending + chunk).split(b'\n')
+                self.pending = lines.pop()
+                for line in lines:
+                    self.line_number += 1
+                    yield self.line_number, line.decode('utf-8', 'replace')
+
+    def settled_line(self) -> str | None:
+        """Returns the unterminated last line once it has the full width of a race line
+        and the file was not written for SETTLE_SECONDS, a log that ends without a newline
+        still counts its last line but a half-written one is never parsed"""
+        line = self.pending.decode('utf-8', 'replace').strip()
+        if len(line) not in RACE_LINE_WIDTHS:
+            return None
+        stat = os.stat(self.path)
+        if stat.st_size != self.offset or time.time_ns() - stat.st_mtime_ns < self.SETTLE_SECONDS * 1e9:
+            return None
+        return line
+
+
+class LiveRace:
+    """Race state fed incrementally from live timing logs. Every update parses only
+    the bytes appended to start.log and end.log since the previous one, merges
+    the new start and finish events into the per-driver times and ranks the
+    laps again. A truncated or rotated log falls back to a full reload."""
+
+    def __init__(self, start_file: Path, end_file: Path, abbr_file: Path):
+        self.tails = (LogTail(start_file), LogTail(end_file))
+        self.abbr_file = abbr_file
+        self.abbr_stat = None
+        self.times = (dict(), dict())
+        self.abbr = dict()
+
+    def settled(self) -> bool:
+        """Returns whether the unterminated last line of every log, if any, is settled. it is part
+        of the fingerprint of a live race, so a settled last line is picked up without another write"""
+        return all(tail.settled_line() is not None for tail in self.tails if tail.pending.strip())
+
+    def reload(self):
+        """Drops the merged state, the next update reads the logs from the top"""
+        for tail, times in zip(self.tails, self.times):
+            tail.reset()
+            times.clear()
+
+    def update(self, errors: list | None = None) -> LapTable:
+        """Merges the appended lines into the race state. returns the ranked laps"""
+        if not all(tail.is_appended() for tail in self.tails):
+            logger.info('A race log was truncated or replaced, reloading it')
+            self.reload()
+        stat = os.stat(self.abbr_file)
+        if (stat.st_mtime_ns, stat.st_size) != self.abbr_stat:
+            self.abbr = parser_drivers(self.abbr_file)
+            self.abbr_stat = (stat.st_mtime_ns, stat.st_size)
+        for tail, times in zip(self.tails, self.times):
+            times.update(iter_race_lines(tail.read_lines(), tail.path, errors))
+        start, end = (dict(times) for times in self.times)
+        for tail, times in zip(self.tails, (start, end)):
+            line = tail.settled_line()
+            if line is not None:
+                try:
+                    driver, date_time = parse_race_line(line)
+                except ValueError:
+                    continue
+                times[driver] = date_time
+        return rank_laps(start, end, self.abbr)
+
+
+def fingerprint_version(fingerprint: tuple) -> str:
+    """This function turns a data files fingerprint into a short version string"""
+    return hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()[:16]
+
+
+def shared_key(version: str) -> str:
+    """This function returns the shared cache key of a lap table version"""
+    return f'report:{SNAPSHOT_FORMAT}:{version}'
+
+
+def dump_snapshot(table: LapTable) -> bytes:
+    """This function serializes a lap table as a binary snapshot. The snapshot is a header
+         (magic, format version, record count, string count and the table version),
+         the durations as int64, one fixed-width record of three uint32 string
+         indexes (code, name, team) per racer, then the string table as uint32
+         offsets followed by the UTF-8 encoded strings. Sections are 8-byte aligned."""
+    strings = dict()
+    records = array('I')
+    for i in range(len(table)):
+        for value in table.record(i):
+            records.append(strings.setdefault(value, len(strings)))
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = array('I', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    durations = array('q', table.durations)
+    if sys.byteorder != 'little':
+        for column in (durations, records, offsets):
+            column.byteswap()
+    version = (table.version or '').encode('ascii')[:16].ljust(16, b'\0')
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, 0, len(table), len(encoded), version)
+    sections = []
+    size = 0
+    for section in (header, durations.tobytes(), records.tobytes(), offsets.tobytes()):
+        sections.append(section)
+        size += len(section)
+        sections.append(bytes(-size % 8))
+        size += -size % 8
+    sections.extend(encoded)
+    return b''.join(sections)
+
+
+def write_snapshot(table: LapTable, path: Path):
+    """This function writes the binary snapshot of a lap table to a file, atomically"""
+    tmp_path = Path(f'{path}.tmp')
+    with open(tmp_path, 'wb') as fp:
+        fp.write(dump_snapshot(table))
+    os.replace(tmp_path, path)
+
+
+def read_snapshot_version(path: Path) -> str | None:
+    """This function returns the table version stored in a snapshot, or None when
+         there is no readable snapshot at the path"""
+    try:
+        with open(path, 'rb') as fp:
+            header = fp.read(SNAPSHOT_HEADER.size)
+    except OSError:
+        return None
+    if len(header) < SNAPSHOT_HEADER.size:
+        return None
+    magic, file_format, _, _, _, version = SNAPSHOT_HEADER.unpack(header)
+    if magic != SNAPSHOT_MAGIC or file_format != SNAPSHOT_FORMAT:
+        return None
+    return version.rstrip(b'\0').decode('ascii') or None
+
+
+@instrumentation.timed('read_snapshot')
+def read_snapshot(path: Path) -> LapTable:
+    """This function memory-maps a binary snapshot and returns its lap table without
+         parsing: the durations stay in the mapped file, so worker processes
+         mapping the same snapshot share its pages"""
+    with open(path, 'rb') as fp:
+        buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    return load_snapshot(buffer, path)
+
+
+def load_snapshot(buffer, source='buffer') -> LapTable:
+    """This function returns the lap table of a binary snapshot held in a buffer, the
+         durations are a view of the buffer"""
+    magic, file_format, _, count, string_count, version = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC or file_format != SNAPSHOT_FORMAT:
+        raise ValueError(f'{source} is not a race snapshot')
+    view = memoryview(buffer)
+    offset = SNAPSHOT_HEADER.size + -SNAPSHOT_HEADER.size % 8
+
+    def section(typecode, length):
+        nonlocal offset
+        size = length * array(typecode).itemsize
+        column = view[offset:offset + size]
+        offset += size + -size % 8
+        if sys.byteorder == 'little':
+            return column.cast(typecode)
+        column = array(typecode, column.tobytes())
+        column.byteswap()
+        return column
+
+    durations = section('q', count)
+    records = section('I', count * 3)
+    offsets = section('I', string_count + 1)
+    blob = view[offset:offset + offsets[-1]]
+    strings = [str(blob[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(string_count)]
+    return LapTable(
+        [strings[i] for i in records[0::3]],
+        [strings[i] for i in records[1::3]],
+        [strings[i] for i in records[2::3]],
+        durations,
+        version.rstrip(b'\0').decode('ascii') or None)
+
+
+class ReportCache:
+    """Keeps parsed race data and computed lap results in memory.
+    The cache is keyed on the (path, mtime, size) of the data files, so it is
+    rebuilt only when one of them actually changes. A lock guards the rebuild,
+    which makes it safe to share between threaded workers, and a rebuilt
+    snapshot is swapped in with a single assignment, so readers never see a
+    half-built one. While a ReportRefresher watches the files, readers skip
+    the file check and only read the current snapshot.
+    With a shared cache backend (anything with the get and set of a cachelib
+    cache) a table is stored there as a binary snapshot keyed on its version,
+    so the workers of a node parse the data files once between them.
+    Listeners are called with the asc report of every new snapshot."""
+
+    def __init__(self, start_file: Path, end_file: Path, abbr_file: Path):
+        self.files = (start_file, end_file, abbr_file)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.errors = []
+        self.watched = False
+        self.live = None
+        self.listeners = []
+        self.shared = None
+
+    def fingerprint(self) -> tuple:
+        """Returns the (path, mtime, size) of every data file and, in live mode,
+             whether the unterminated last lines of the logs are settled"""
+        fingerprint = []
+        for file in self.files:
+            stat = os.stat(file)
+            fingerprint.append((str(file), stat.st_mtime_ns, stat.st_size))
+        if self.live is not None:
+            fingerprint.append(self.live.settled())
+        return tuple(fingerprint)
+
+    @property
+    def snapshot_file(self) -> Path:
+        """The binary snapshot compiled next to the data files"""
+        return Path(self.files[0]).parent / SNAPSHOT_FILE.name
+
+    @instrumentation.timed('load')
+    def load(self, key: tuple) -> LapTable:
+        """Parses the data files and ranks the laps of the given version. With live
+             ingestion on, only the lines appended since the last load are parsed.
+             A binary snapshot compiled from this very version is read instead"""
+        start_file, end_file, abbr_file = self.files
+        errors = []
+        version = fingerprint_version(key)
+        parsed = False
+        if self.live is not None:
+            table = self.live.update(errors)
+        elif read_snapshot_version(self.snapshot_file) == version:
+            table = read_snapshot(self.snapshot_file)
+        else:
+            table = self.read_shared(version)
+            if table is None:
+                table = rank_laps(
+                    parse_race_file(start_file, errors),
+                    parse_race_file(end_file, errors),
+                    parser_drivers(abbr_file))
+                parsed = True
+        table.version = version
+        if parsed:
+            self.write_shared(table)
+        self.errors = errors
+        return table
+
+    def read_shared(self, version: str) -> LapTable | None:
+        """Returns the table of a version from the shared cache, None when it is not there"""
+        if self.shared is None:
+            return None
+        try:
+            data = self.shared.get(shared_key(version))
+            return None if data is None else load_snapshot(data, 'shared cache')
+        except Exception as error:
+            logger.warning('The shared cache could not be read: %s', error)
+            return None
+
+    def write_shared(self, table: LapTable):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(shared_key(table.version), dump_snapshot(table))
+        except Exception as error:
+            logger.warning('The shared cache could not be written: %s', error)
+
+    def refresh(self) -> tuple:
+        """Rebuilds the snapshot if the data files changed. returns the current
+             snapshot, a (fingerprint, table, reports by order) tuple"""
+        key = self.fingerprint()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == key:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot[0] == key:
+                return snapshot
+            snapshot = (key, self.load(key), dict())
+            self._snapshot = snapshot
+        for listener in list(self.listeners):
+            try:
+                listener(Report(snapshot[1]))
+            except Exception:
+                logger.exception('A report listener failed')
+        return snapshot
+
+    def extent(self) -> tuple:
+        """Returns the table of the current snapshot and which of its lazily built parts exist:
+             the formatted times, the analytics, the descending order and the driver indexes of the reports"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return (None,)
+        _, table, reports = snapshot
+        indexed = sorted(order for order, report in list(reports.items()) if 'index' in report.__dict__)
+        built = tuple(name in table.__dict__ for name in ('times', 'analytics', 'descending'))
+        return table, built, tuple(indexed)
+
+    def nbytes(self) -> int:
+        """Returns an estimate of the memory held by the current snapshot, its lap table
+             and the driver indexes built on its reports"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return 0
+        _, table, reports = snapshot
+        return table.nbytes() + sum(report.index.nbytes() for report in list(reports.values())
+                                    if 'index' in report.__dict__)
+
+    def is_current(self, table: LapTable) -> bool:
+        """Returns whether the table is the one of the current snapshot"""
+        snapshot = self._snapshot
+        return snapshot is not None and snapshot[1] is table
+
+    def get(self, order) -> Report:
+        """Returns the lap results for the order, rebuilding them if the data files changed"""
+        snapshot = self._snapshot
+        if snapshot is None or not self.watched:
+            snapshot = self.refresh()
+        key, table, reports = snapshot
+        order = 'desc' if order == 'desc' else 'asc'
+        report = reports.get(order)
+        if report is None:
+            report = reports.setdefault(order, Report(table, order))
+        return report
+
+    def follow(self):
+        """Turns on live ingestion, later loads parse only the appended log lines"""
+        with self._lock:
+            if self.live is None:
+                self.live = LiveRace(*self.files)
+
+    def invalidate(self):
+        """Drops everything cached, the next call re-reads the data files"""
+        with self._lock:
+            self._snapshot = None
+            if self.live is not None:
+                self.live.reload()
+
+    def compile_snapshot(self) -> Path:
+        """Writes the binary snapshot of the current version of the data files"""
+        _, table, _ = self.refresh()
+        write_snapshot(table, self.snapshot_file)
+        return self.snapshot_file
+
+
+class ReportRefresher(threading.Thread):
+    """A daemon thread that watches the data files and rebuilds the report as soon
+    as they change, so requests only ever read a ready snapshot. It waits on
+    inotify when inotify_simple is installed and polls the files otherwise."""
+
+    def __init__(self, cache: ReportCache, interval: float = 1.0):
+        super().__init__(name='report-refresher', daemon=True)
+        self.cache = cache
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def start(self):
+        self.cache.watched = True
+        super().start()
+
+    def run(self):
+        inotify = None
+        try:
+            try:
+                inotify = self._open_inotify()
+            except OSError as error:
+                logger.warning('The data files cannot be watched with inotify, polling them instead: %s', error)
+            timeout = int(self.interval * 1000)
+            wait = self._poll_wait if inotify is None else lambda: inotify.read(timeout=timeout)
+            while not self._stopped.is_set():
+                try:
+                    self.cache.refresh()
+                except Exception:
+                    logger.exception('Failed to refresh the report')
+                wait()
+        finally:
+            if inotify is not None:
+                inotify.close()
+            self.cache.watched = False
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
+
+    def _poll_wait(self):
+        self._stopped.wait(self.interval)
+
+    def _open_inotify(self):
+        """Returns an inotify instance watching the directories of the data files,
+        None when inotify_simple is not installed"""
+        if inotify_simple is None:
+            return None
+        inotify = inotify_simple.INotify()
+        watch_flags = (inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MODIFY
+                       | inotify_simple.flags.MOVED_TO | inotify_simple.flags.CREATE)
+        try:
+            for directory in {Path(file).parent for file in self.cache.files}:
+                inotify.add_watch(directory, watch_flags)
+        except OSError:
+            inotify.close()
+            raise
+        return inotify
+
+
+class RaceCatalog:
+    """The races stored under a data root, one directory per race holding its own
+    start.log, end.log and abbreviations.txt. A race is loaded on first access and
+    kept in a least recently used cache bounded by the number of races and by
+    the memory of their snapshots. The memory of a race is estimated again whenever
+    its table changes or the formatted times, analytics or driver indexes of it are
+    built, which is checked on every access to the catalog."""
+
+    def __init__(self, root: Path, max_races: int = 64, max_bytes: int = 64 << 20):
+        self.root = Path(root)
+        self.max_races = max_races
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._caches = OrderedDict()
+        self._sizes = dict()
+        self.shared = None
+
+    def races(self) -> list[str]:
+        """Returns the ids of the race directories found under the root"""
+        if not self.root.is_dir():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if self.is_race(path.name))
+
+    def is_race(self, race_id: str) -> bool:
+        """Returns whether a race directory holding the three data files is under the root"""
+        if race_id in ('', '.', '..') or Path(race_id).name != race_id:
+            return False
+        race_dir = self.root / race_id
+        return all((race_dir / file.name).is_file() for file in (STARTLOG_FILE, ENDLOG_FILE, ABBR_FILE))
+
+    def cache(self, race_id: str) -> ReportCache:
+        """Returns the report cache of a race, it raises KeyError for an unknown race"""
+        with self._lock:
+            cache = self._caches.get(race_id)
+            if cache is not None:
+                self._caches.move_to_end(race_id)
+                return cache
+        if not self.is_race(race_id):
+            raise KeyError(race_id)
+        race_dir = self.root / race_id
+        with self._lock:
+            cache = self._caches.setdefault(race_id, ReportCache(
+                race_dir / STARTLOG_FILE.name,
+                race_dir / ENDLOG_FILE.name,
+                race_dir / ABBR_FILE.name))
+            cache.shared = self.shared
+            self._caches.move_to_end(race_id)
+        return cache
+
+    def build_report(self, race_id: str, order) -> Report:
+        """Returns the lap results of a race, loading the race on first access"""
+        report = self.cache(race_id).get(order)
+        with self._lock:
+            if self._measure():
+                self._evict()
+        return report
+
+    def _measure(self) -> bool:
+        """Estimates the memory of the loaded races whose extent changed since their last
+        estimate. returns whether any estimate changed"""
+        changed = False
+        for race_id, cache in self._caches.items():
+            extent = cache.extent()
+            sized = self._sizes.get(race_id)
+            if sized is None or sized[0] != extent:
+                self._sizes[race_id] = (extent, cache.nbytes())
+                changed = True
+        return changed
+
+    def _evict(self):
+        while len(self._caches) > 1 and (
+                len(self._caches) > self.max_races
+                or sum(size for _, size in self._sizes.values()) > self.max_bytes):
+            race_id, _ = self._caches.popitem(last=False)
+            self._sizes.pop(race_id, None)
+            logger.info('Unloaded race %s', race_id)
+
+    def __contains__(self, race_id: str) -> bool:
+        with self._lock:
+            return race_id in self._caches
+
+
+report_cache = ReportCache(STARTLOG_FILE, ENDLOG_FILE, ABBR_FILE)
+race_catalog = RaceCatalog(RACES_DIR)
+refresher = None
+
+
+@instrumentation.timed('build_report')
 def build_report(order):
-    start = parse_race_file(STARTLOG_FILE)
-    end = parse_race_file(ENDLOG_FILE)
-    abbr = parser_drivers(ABBR_FILE)
-    result = dict()
-    zero_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    for name, st_time in start.items():
-        if st_time > end[name]:
-            st_time, end[name] = end[name], st_time
-        time_difference = (
-            zero_time + (end[name] - st_time)).strftime(STRTIME_FORMAT)
-        result[str(time_difference)] = name, *abbr[name]
-        if order == 'desc':
-            result = dict(reversed(result.items()))
-    return result
+    """This function returns the lap results of the race. The results are served
+         from the report cache and are recomputed only when the data files change"""
+    return report_cache.get(order)
+
+
+def invalidate_cache():
+    """Forces the next build_report call to re-read the data files"""
+    report_cache.invalidate()
+
+
+def start_refresher(interval: float = 1.0, live: bool = False) -> ReportRefresher:
+    """This function starts rebuilding the report in a background thread whenever
+         the data files change. With live, appended log lines are ingested
+         incrementally instead of re-reading the logs. returns the running refresher"""
+    global refresher
+    if live:
+        report_cache.follow()
+    refresher = ReportRefresher(report_cache, interval)
+    refresher.start()
+    return refresher
+
+
+def share_cache(backend):
+    """This function makes the report cache and the caches of the race catalog store their
+         lap tables in a shared cache backend, None keeps them in this process only"""
+    report_cache.shared = backend
+    race_catalog.shared = backend
+    with race_catalog._lock:
+        for cache in race_catalog._caches.values():
+            cache.shared = backend
 
 
+def after_fork():
+    """This function runs in a worker forked from a preloading server. threads do not
+         survive a fork, so the locks are renewed, the files are checked on every read
+         again and a refresher started before the fork gets a replacement"""
+    for cache in (report_cache, race_catalog, *race_catalog._caches.values()):
+        cache._lock = threading.Lock()
+    report_cache.watched = False
+    if refresher is not None:
+        start_refresher(refresher.interval, live=report_cache.live is not None)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+
+def preload():
+    """This function parses the race data and builds both orders of the report,
+         their driver indexes, the formatted lap times and the analytics, then moves everything
+         allocated so far to the permanent generation of the garbage collector.
+         a collection in a forked worker then never writes to the pages it shares
+         with the master"""
+    for order in ('asc', 'desc'):
+        report = build_report(order)
+        report.index
+    report.table.times
+    report.table.analytics
+    gc.collect()
+    gc.freeze()
+
+
+@instrumentation.timed('get_racer_data')
 def get_racer_data(report: dict[str, tuple], name: str):
-    racer_data = dict(filter(lambda item: name in item[1], report.items()))
-    return racer_data
+    """This function finds a racer by code, full name or team. returns the matching
+         lap results as a report, or as a dictionary for a plain dictionary report.
+         The result is empty when nothing matches"""
+    if isinstance(report, Report):
+        return report.subset(report.index.lookup(name))
+    items = list(report.items())
+    return dict(items[position] for position in DriverIndex(report).lookup(name))
+
+
+@instrumentation.timed('get_racers_data')
+def get_racers_data(report: dict[str, tuple], codes) -> tuple:
+    """This function finds several racers by code in one report. returns the matching
+         lap results in report order, as a report or as a dictionary for a plain
+         dictionary report, and the codes that were not found"""
+    index = report.index if isinstance(report, Report) else DriverIndex(report)
+    positions, missing = [], []
+    for code in dict.fromkeys(codes):
+        position = index.by_code.get(code)
+        if position is None:
+            missing.append(code)
+        else:
+            positions.append(position)
+    positions.sort()
+    if isinstance(report, Report):
+        return report.subset(positions), missing
+    items = list(report.items())
+    return dict(items[position] for position in positions), missing
@@ -45,7 +45,7 @@ http://localhost:5000/report/drivers/?order=desc""",
     ],
     entry_points={
         'console_scripts': [
-            'task_7_flask = main:__main__'
+            'task_7_flask = wsgi:run'
         ]
     },
     keywords="sample, setuptools, development",
@@ -57,6 +57,7 @@ http://localhost:5000/report/drivers/?order=desc""",
     extras_require={
                     "dev": ["check-manifest"],
                     "test": ["coverage"],
+                    "redis": ["redis == 5.0.4"],
     },
     package_data={
         "files": ["data/*"],
@@ -1,6 +1,15 @@
+import asyncio
+import gzip
 import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
 
-from flask import Flask, jsonify, url_for
+from flask import Flask, jsonify, request, url_for
 import unittest
 from unittest.mock import mock_open, patch, Mock
 from pathlib import Path
@@ -9,7 +18,13 @@ from flask_restful import Api, Resource
 import xml.etree.ElementTree as ET
 import datetime
 import report_racers
-from main import app, api, IndexApi, NamePage
+import leaderboard
+import asgi
+import instrumentation
+from main import api, IndexApi, NamePage
+import main
+
+app = main.create_app()
 
 
 class TestMonacoFileFlask(unittest.TestCase):
@@ -25,9 +40,9 @@ class TestMonacoFileFlask(unittest.TestCase):
         mock_content = report_racers.read_data_file(file_path)
         self.assertEqual(mock_content, expected_content)
 
-    @patch('report_racers.read_data_file')
+    @patch('report_racers.iter_data_file')
     def test_parse_log(self, mock_read_file_log):
-        mock_read_file_log.return_value = ['SVF2018-05-24_12:02:58.917']
+        mock_read_file_log.return_value = iter(['SVF2018-05-24_12:02:58.917'])
         mock_path_log = Path(__file__).resolve().parent / "test"
         mock_result = report_racers.parse_race_file(mock_path_log)
         expected_result_log = {
@@ -35,6 +50,27 @@ class TestMonacoFileFlask(unittest.TestCase):
                 2018, 5, 24, 12, 2, 58, 917000)}
         self.assertEqual(mock_result, expected_result_log)
 
+    @patch('report_racers.iter_data_file')
+    def test_parse_log_skips_bad_lines(self, mock_read_file_log):
+        mock_read_file_log.return_value = iter([
+            '', 'SVF2018-05-24_12:02:58.917 ', 'broken', '',
+            'NHR2018-05-24_12:02:49.914'])
+        errors = []
+        mock_result = report_racers.parse_race_file(Path('test'), errors)
+        self.assertEqual(list(mock_result), ['SVF', 'NHR'])
+        self.assertEqual(errors, [('test', 3, 'broken')])
+
+    def test_parse_timestamp(self):
+        for value in ('2018-05-24_12:02:58.917', '2018-05-24_12:02:58.917123',
+                      '2018-05-24_12:02:58.9'):
+            self.assertEqual(
+                report_racers.parse_timestamp(value),
+                datetime.datetime.strptime(
+                    value, report_racers.DATETIME_FORMAT))
+        for value in ('2018-05-24_12:02:58.91Z', '2018-13-24_12:02:58.917'):
+            with self.assertRaises(ValueError):
+                report_racers.parse_timestamp(value)
+
     @patch('report_racers.read_data_file')
     def test_parse_driver(self, mock_read_file_driver):
         mock_read_file_driver.return_value = ['DDR_Daniel_REDBULL']
@@ -46,6 +82,8 @@ class TestMonacoFileFlask(unittest.TestCase):
     @patch('report_racers.parse_race_file')
     @patch('report_racers.parser_drivers')
     def test_build(self, mock_abbr, mock_str_or_end):
+        report_racers.invalidate_cache()
+        self.addCleanup(report_racers.invalidate_cache)
         result_str = {
             'DDR': datetime.datetime(
                 2018, 5, 24, 12, 2, 58, 917000)}
@@ -320,5 +358,1032 @@ class TestMonacoNamePage(unittest.TestCase):
         self.assertEqual(response_name_xml.data, expected_name_xml)
 
 
+class RaceFilesTestCase(unittest.TestCase):
+    """Writes the start.log, end.log and abbreviations.txt of a race to a temporary data_dir"""
+    START = 'SVF2018-05-24_12:02:58.917\n'
+    END = 'SVF2018-05-24_12:04:03.332\n'
+    ABBREVIATIONS = 'SVF_Sebastian Vettel_FERRARI\n'
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.data_dir = Path(tmp_dir.name)
+        self.files = self.write_race(self.data_dir)
+
+    def write_race(self, race_dir, end=None):
+        race_dir.mkdir(exist_ok=True)
+        files = (race_dir / 'start.log', race_dir / 'end.log', race_dir / 'abbreviations.txt')
+        for path, content in zip(files, (self.START, self.END if end is None else end, self.ABBREVIATIONS)):
+            path.write_text(content)
+        return files
+
+    def write(self, name, content, mtime_shift=0):
+        path = self.data_dir / name
+        path.write_text(content)
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_shift))
+
+
+class TestReportCache(RaceFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = report_racers.ReportCache(*self.files)
+
+    def test_cache_reuses_parsed_data(self):
+        with patch('report_racers.parse_race_file',
+                   wraps=report_racers.parse_race_file) as mock_parse:
+            first = self.cache.get('asc')
+            second = self.cache.get('asc')
+        self.assertEqual(first, {'01:04.415000': (
+            'SVF', 'Sebastian Vettel', 'FERRARI')})
+        self.assertIs(first, second)
+        self.assertEqual(mock_parse.call_count, 2)
+
+    def test_cache_rebuilds_on_file_change(self):
+        self.cache.get('asc')
+        self.write('end.log', 'SVF2018-05-24_12:04:13.332\n',
+                   mtime_shift=10 ** 9)
+        self.assertEqual(self.cache.get('asc'), {'01:14.415000': (
+            'SVF', 'Sebastian Vettel', 'FERRARI')})
+
+    def test_refresher_swaps_snapshot(self):
+        refresher = report_racers.ReportRefresher(self.cache, interval=0.01)
+        refresher.start()
+        self.addCleanup(refresher.stop)
+        first = self.cache.get('asc')
+        self.assertTrue(self.cache.watched)
+        self.write('end.log', 'SVF2018-05-24_12:04:13.332\n',
+                   mtime_shift=10 ** 9)
+        for _ in range(500):
+            if self.cache.get('asc') is not first:
+                break
+            refresher._stopped.wait(0.01)
+        self.assertEqual(self.cache.get('asc'), {'01:14.415000': (
+            'SVF', 'Sebastian Vettel', 'FERRARI')})
+        refresher.stop()
+        self.assertFalse(self.cache.watched)
+
+    def test_refresher_polls_when_inotify_fails(self):
+        inotify = Mock()
+        inotify.add_watch.side_effect = FileNotFoundError('data dir')
+        mock_inotify = Mock(INotify=Mock(return_value=inotify),
+                            flags=Mock(CLOSE_WRITE=1, MODIFY=2, MOVED_TO=4, CREATE=8))
+        refresher = report_racers.ReportRefresher(self.cache, interval=0.01)
+        with patch('report_racers.inotify_simple', mock_inotify), \
+                self.assertLogs('report_racers', level='WARNING'), \
+                patch.object(self.cache, 'refresh', wraps=self.cache.refresh) as mock_refresh:
+            refresher.start()
+            self.addCleanup(refresher.stop)
+            for _ in range(500):
+                if mock_refresh.call_count > 1:
+                    break
+                time.sleep(0.01)
+        inotify.close.assert_called_once()
+        self.assertTrue(refresher.is_alive())
+        self.assertTrue(self.cache.watched)
+        refresher.stop()
+        self.assertFalse(self.cache.watched)
+
+    def test_snapshot_round_trip(self):
+        table = report_racers.LapTable.from_rows([
+            (64415000, 'SVF', 'Sebastian Vettel', 'FERRARI'),
+            (64415000, 'KRF', 'Kimi Räikkönen', 'FERRARI'),
+            (72460000, 'LHM', 'Lewis Hamilton', '')])
+        table.version = 'abc'
+        path = self.data_dir / 'test.snap'
+        report_racers.write_snapshot(table, path)
+        loaded = report_racers.read_snapshot(path)
+        self.assertEqual(loaded.version, 'abc')
+        self.assertEqual(report_racers.Report(loaded), report_racers.Report(table))
+        self.assertEqual(list(loaded.durations), list(table.durations))
+
+    def test_cache_reads_matching_snapshot(self):
+        self.cache.compile_snapshot()
+        self.cache.invalidate()
+        with patch('report_racers.parse_race_file') as mock_parse:
+            report = self.cache.get('asc')
+        mock_parse.assert_not_called()
+        self.assertIsInstance(report.table.durations, memoryview)
+        self.assertEqual(report, {'01:04.415000': (
+            'SVF', 'Sebastian Vettel', 'FERRARI')})
+
+        self.write('end.log', 'SVF2018-05-24_12:04:13.332\n',
+                   mtime_shift=10 ** 9)
+        self.assertEqual(self.cache.get('asc'), {'01:14.415000': (
+            'SVF', 'Sebastian Vettel', 'FERRARI')})
+
+    def test_cache_invalidate(self):
+        with patch('report_racers.parse_race_file',
+                   wraps=report_racers.parse_race_file) as mock_parse:
+            self.cache.get('asc')
+            self.cache.invalidate()
+            self.cache.get('asc')
+        self.assertEqual(mock_parse.call_count, 4)
+
+
+class TestLiveRace(RaceFilesTestCase):
+    START = 'SVF2018-05-24_12:02:58.917\nLHM2018-05-24_12:18:20.125\n'
+    END = 'SVF2018-05-24_12:04:03.332'
+    ABBREVIATIONS = 'SVF_Sebastian Vettel_FERRARI\nLHM_Lewis Hamilton_MERCEDES\n'
+
+    def setUp(self):
+        super().setUp()
+        self.settle('end.log')
+        self.live = report_racers.LiveRace(*self.files)
+
+    def append(self, name, content):
+        with open(self.data_dir / name, 'a') as fp:
+            fp.write(content)
+
+    def settle(self, name):
+        settled = time.time() - report_racers.LogTail.SETTLE_SECONDS - 1
+        os.utime(self.data_dir / name, (settled, settled))
+
+    def test_matches_full_parse(self):
+        live = report_racers.LiveRace(
+            report_racers.STARTLOG_FILE, report_racers.ENDLOG_FILE,
+            report_racers.ABBR_FILE)
+        self.assertEqual(report_racers.Report(live.update()),
+                         report_racers.Report(report_racers.rank_laps(
+                             report_racers.parse_race_file(report_racers.STARTLOG_FILE),
+                             report_racers.parse_race_file(report_racers.ENDLOG_FILE),
+                             report_racers.parser_drivers(report_racers.ABBR_FILE))))
+
+    def test_appended_lines_are_merged(self):
+        self.assertEqual(self.live.update().codes, ['SVF'])
+        start_tail, end_tail = self.live.tails
+        start_offset = start_tail.offset
+        self.append('end.log', '\nLHM2018-05-24_12:11:32.585\n')
+        with patch('report_racers.parse_race_file') as mock_parse:
+            table = self.live.update()
+        mock_parse.assert_not_called()
+        self.assertEqual(start_tail.offset, start_offset)
+        self.assertEqual(table.codes, ['SVF', 'LHM'])
+        self.assertEqual(table.times, ['01:04.415000', '06:47.540000'])
+
+    def test_half_written_line_waits_for_its_newline(self):
+        self.live.update()
+        self.append('end.log', '\nLHM2018-05-24_12:11:32.58')
+        self.assertEqual(self.live.update().codes, ['SVF'])
+        self.settle('end.log')
+        self.assertEqual(self.live.update().codes, ['SVF'])
+        self.append('end.log', '5')
+        self.assertEqual(self.live.update().codes, ['SVF'])
+        self.assertFalse(self.live.settled())
+        self.settle('end.log')
+        self.assertTrue(self.live.settled())
+        self.assertEqual(self.live.update().times, ['01:04.415000', '06:47.540000'])
+
+    def test_truncated_log_is_reloaded(self):
+        self.live.update()
+        (self.data_dir / 'end.log').write_text('SVF2018-05-24_12:04:13.332\n')
+        self.assertEqual(self.live.update().times, ['01:14.415000'])
+        (self.data_dir / 'start.log').write_text('')
+        self.assertEqual(len(self.live.update()), 0)
+
+
+class TestLeaderboardHub(RaceFilesTestCase):
+    SUBSCRIBERS = 300
+    START = TestLiveRace.START
+    ABBREVIATIONS = TestLiveRace.ABBREVIATIONS
+
+    def setUp(self):
+        super().setUp()
+        self.cache = report_racers.ReportCache(*self.files)
+        self.hub = leaderboard.LeaderboardHub(self.cache)
+
+    @staticmethod
+    def event_data(message):
+        data = message.decode('utf-8').split('data: ', 1)[1]
+        return json.loads(data)
+
+    def test_diff_is_fanned_out_once(self):
+        self.cache.get('asc')
+        subscribers = [self.hub.subscribe(leaderboard.QueueSubscriber())
+                       for _ in range(self.SUBSCRIBERS)]
+        with open(self.data_dir / 'end.log', 'a') as fp:
+            fp.write('LHM2018-05-24_12:11:32.585\n')
+        with patch('leaderboard.leaderboard_diff',
+                   wraps=leaderboard.leaderboard_diff) as mock_diff:
+            self.cache.refresh()
+        self.assertEqual(mock_diff.call_count, 1)
+        messages = {subscriber.get(timeout=0)[1] for subscriber in subscribers}
+        self.assertEqual(len(messages), 1)
+        diff = self.event_data(messages.pop())
+        self.assertEqual(diff['size'], 2)
+        self.assertEqual([change['position'] for change in diff['changes']], [2])
+        self.assertEqual(diff['changes'][0]['code'], 'LHM')
+
+    def test_snapshot_taken_before_publish_is_not_lost(self):
+        self.cache.get('asc')
+        subscriber = self.hub.subscribe(leaderboard.QueueSubscriber())
+        with open(self.data_dir / 'end.log', 'a') as fp:
+            fp.write('LHM2018-05-24_12:11:32.585\n')
+        with patch.object(self.cache, 'listeners', []):
+            self.cache.refresh()
+        version, _ = self.hub.snapshot()
+        stale = report_racers.Report(report_racers.LapTable.from_rows([]))
+        self.hub.publish(stale)
+        self.hub.publish(self.cache.get('asc'))
+        event = subscriber.get(timeout=0)
+        self.assertEqual(event[0], version)
+        self.assertEqual([change['code'] for change in self.event_data(event[1])['changes']], ['LHM'])
+        self.assertIsNone(subscriber.get(timeout=0))
+
+    def test_nothing_is_computed_without_subscribers(self):
+        with patch('leaderboard.leaderboard_rows') as mock_rows:
+            self.cache.get('asc')
+        mock_rows.assert_not_called()
+        self.assertIs(self.hub._report.table, self.cache.get('asc').table)
+
+    def test_stream_starts_with_snapshot_and_resyncs(self):
+        subscriber = self.hub.subscribe(leaderboard.QueueSubscriber(maxsize=1))
+        stream = self.hub.stream(subscriber, keepalive=0)
+        self.assertEqual(self.event_data(next(stream))['size'], 1)
+        self.assertEqual(next(stream), b': keepalive\n\n')
+        subscriber.push('v1', b'first')
+        subscriber.push('v2', b'second')
+        self.assertTrue(subscriber.resync)
+        self.assertEqual(self.event_data(next(stream))['size'], 1)
+        stream.close()
+        self.assertNotIn(subscriber, self.hub._subscribers)
+
+    def test_watching_does_not_switch_to_live_ingestion(self):
+        self.hub.ensure_watching(interval=0.01)
+        self.addCleanup(self.hub._refresher.stop)
+        self.assertIsNone(self.cache.live)
+        self.assertTrue(self.cache.watched)
+
+    def test_failing_listener_is_logged(self):
+        received = []
+        self.cache.listeners.insert(0, Mock(side_effect=RuntimeError('listener')))
+        self.cache.listeners.append(received.append)
+        with self.assertLogs('report_racers', level='ERROR'):
+            self.cache.get('asc')
+        self.assertEqual(len(received), 1)
+
+    def test_refresher_survives_unexpected_errors(self):
+        refresher = report_racers.ReportRefresher(self.cache, interval=0.01)
+        with patch.object(self.cache, 'refresh', side_effect=RuntimeError('refresh')) as mock_refresh, \
+                self.assertLogs('report_racers', level='ERROR'):
+            refresher.start()
+            self.addCleanup(refresher.stop)
+            for _ in range(500):
+                if mock_refresh.call_count > 1:
+                    break
+                time.sleep(0.01)
+        self.assertTrue(refresher.is_alive())
+        self.assertGreater(mock_refresh.call_count, 1)
+
+    @patch('main.leaderboard_hub.ensure_watching')
+    def test_stream_endpoint(self, mock_watching):
+        response = app.test_client().get('/api/v1/report/stream/')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        first = next(response.response)
+        response.close()
+        self.assertIn(b'event: leaderboard', first)
+        self.assertEqual(self.event_data(first)['size'],
+                         len(report_racers.build_report('asc')))
+        mock_watching.assert_called_once()
+
+
+class TestRanking(unittest.TestCase):
+    def setUp(self):
+        start_time = datetime.datetime(2018, 5, 24, 12, 0, 0)
+        self.start = {
+            'NHR': start_time,
+            'SVF': start_time,
+            'KRF': start_time + datetime.timedelta(minutes=2),
+            'LHM': start_time}
+        self.end = {
+            'NHR': start_time + datetime.timedelta(seconds=73.065),
+            'SVF': start_time + datetime.timedelta(seconds=64.415),
+            'KRF': start_time + datetime.timedelta(seconds=40),
+            'LHM': start_time + datetime.timedelta(seconds=64.415)}
+        self.abbr = {
+            'NHR': ['Nico Hulkenberg', 'RENAULT'],
+            'SVF': ['Sebastian Vettel', 'FERRARI'],
+            'KRF': ['Kimi Räikkönen', 'FERRARI'],
+            'LHM': ['Lewis Hamilton', 'MERCEDES']}
+
+    def test_rank_laps(self):
+        table = report_racers.rank_laps(self.start, self.end, self.abbr)
+        self.assertEqual(table.codes, ['LHM', 'SVF', 'NHR', 'KRF'])
+        self.assertEqual(table.durations[-1], 80000000)
+        self.assertEqual(table.durations.typecode, 'q')
+
+    def test_report_orders_share_rows(self):
+        table = report_racers.rank_laps(self.start, self.end, self.abbr)
+        asc = report_racers.Report(table, 'asc')
+        desc = report_racers.Report(table, 'desc')
+        self.assertEqual(len(asc), 4)
+        self.assertEqual(list(asc.items())[:2], [
+            ('01:04.415000', ('LHM', 'Lewis Hamilton', 'MERCEDES')),
+            ('01:04.415000', ('SVF', 'Sebastian Vettel', 'FERRARI'))])
+        self.assertEqual([record[0] for record in desc.values()], ['KRF', 'NHR', 'LHM', 'SVF'])
+        self.assertIs(report_racers.Report(table, 'desc').positions, desc.positions)
+
+    def test_ties_keep_code_order_in_both_orders(self):
+        table = report_racers.rank_laps(self.start, self.end, self.abbr)
+        self.assertEqual(list(report_racers.descending_positions([1, 2, 2, 3, 3, 3])), [3, 4, 5, 1, 2, 0])
+        self.assertEqual([team for team, _ in report_racers.Report(table, 'asc').teams()],
+                         ['MERCEDES', 'FERRARI', 'RENAULT'])
+        self.assertEqual([team for team, _ in report_racers.Report(table, 'desc').teams()],
+                         ['RENAULT', 'MERCEDES', 'FERRARI'])
+
+    def test_report_head_and_team(self):
+        table = report_racers.rank_laps(self.start, self.end, self.abbr)
+        report = report_racers.Report(table, 'desc')
+        self.assertEqual([record[0] for record in report.head(2).values()],
+                         ['KRF', 'NHR'])
+        self.assertEqual([record[0] for record in report.by_team('FERRARI').values()],
+                         ['KRF', 'SVF'])
+
+    def test_format_lap_time(self):
+        self.assertEqual(report_racers.format_lap_time(41761000), '00:41.761000')
+        self.assertEqual(report_racers.format_lap_time(3_661_000_001), '01:01.000001')
+
+
+class TestDriverIndex(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.report = report_racers.Report(report_racers.LapTable.from_rows([
+            (64415000, 'SVF', 'Sebastian Vettel', 'FERRARI'),
+            (72434000, 'KRF', 'Kimi Räikkönen', 'FERRARI'),
+            (72460000, 'LHM', 'Lewis Hamilton', 'MERCEDES')]))
+
+    def test_lookup_by_code_name_and_team(self):
+        self.assertEqual(
+            report_racers.get_racer_data(self.report, 'LHM'),
+            {'01:12.460000': ('LHM', 'Lewis Hamilton', 'MERCEDES')})
+        self.assertEqual(
+            report_racers.get_racer_data(self.report, 'Sebastian Vettel'),
+            {'01:04.415000': ('SVF', 'Sebastian Vettel', 'FERRARI')})
+        self.assertEqual(
+            list(report_racers.get_racer_data(self.report, 'FERRARI')),
+            ['01:04.415000', '01:12.434000'])
+        self.assertEqual(report_racers.get_racer_data(self.report, 'XXX'), {})
+
+    def test_index_is_built_once(self):
+        self.assertIs(self.report.index, self.report.index)
+
+    @patch('report_racers.build_report')
+    def test_unknown_driver_returns_404(self, mock_build):
+        mock_build.return_value = self.report
+        self.assertEqual(
+            self.client.get('/report/drivers/XXX').status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/v1/report/drivers/XXX/').status_code, 404)
+
+
+class TestStreamingXML(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    @staticmethod
+    def element_tree_xml(data):
+        root = ET.Element('drivers')
+        for time, record in data.items():
+            driver_element = ET.SubElement(root, 'driver')
+            ET.SubElement(driver_element, 'time').text = time
+            data_element = ET.SubElement(driver_element, 'data')
+            ET.SubElement(data_element, 'code').text = record[0]
+            ET.SubElement(data_element, 'name').text = record[1]
+            ET.SubElement(data_element, 'team').text = record[2]
+        return ET.tostring(root, encoding='utf-8', method='xml')
+
+    def test_output_matches_element_tree(self):
+        for data in ({},
+                     {'01:00.000': ('DRR', 'Kimi Räikkönen', 'A & B <C>')},
+                     {'01:00.000': ('DRR', 'Daniel Ricciardo', ''),
+                      '01:01.000': ('SVF', 'Sebastian Vettel', 'FERRARI')}):
+            self.assertEqual(main.RenderXML.dictxml(data),
+                             self.element_tree_xml(data))
+
+    def test_stream_response(self):
+        response = self.client.get('/api/v1/report/?format=xml&stream=1')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/xml')
+        self.assertEqual(
+            response.data,
+            self.element_tree_xml(report_racers.build_report('asc')))
+
+
+class TestJsonRenderers(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.data = {
+            '01:04.415000': ('SVF', 'Sebastian Vettel', 'FERRARI'),
+            '01:12.639000': ('KRF', 'Kimi Räikkönen', 'FERRARI')}
+
+    def test_backends_write_the_same_bytes(self):
+        with patch.object(main.RenderJson, 'dumps',
+                          staticmethod(main.stdlib_json_dumps)):
+            stdlib_body = main.RenderJson.dictjson(self.data)
+        self.assertEqual(main.RenderJson.dictjson(self.data), stdlib_body)
+        self.assertEqual(json.loads(stdlib_body),
+                         {time: list(record) for time, record in self.data.items()})
+
+    def test_tied_lap_times_are_all_parsed_as_records(self):
+        table = report_racers.LapTable.from_rows([(64_415_000, 'SVF', 'Sebastian Vettel', 'FERRARI'),
+                                                  (64_415_000, 'KRF', 'Kimi Räikkönen', 'FERRARI')])
+        data = json.loads(main.RenderJsonRecords.dictjson(report_racers.Report(table)))
+        self.assertEqual([(record['time'], record['code']) for record in data],
+                         [('01:04.415000', 'KRF'), ('01:04.415000', 'SVF')])
+
+    def test_records_format(self):
+        data = json.loads(self.client.get('/api/v1/report/?format=records&limit=1').data)
+        self.assertEqual(data, [{'time': '01:04.415000', 'code': 'SVF',
+                                 'name': 'Sebastian Vettel', 'team': 'FERRARI'}])
+        teams = json.loads(self.client.get('/api/v1/report/teams/?format=records').data)
+        self.assertEqual((teams[0]['name'], teams[0]['best_code']), ('FERRARI', 'SVF'))
+        batch = json.loads(self.client.get('/api/v1/report/drivers/batch/?codes=SVF,XXX&format=records').data)
+        self.assertEqual(batch, {'drivers': data, 'missing': ['XXX']})
+
+    @patch('report_racers.build_report')
+    def test_ndjson(self, mock_build):
+        mock_build.return_value = self.data
+        response = self.client.get('/api/v1/report/?format=ndjson')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'time': '01:04.415000', 'code': 'SVF',
+             'name': 'Sebastian Vettel', 'team': 'FERRARI'},
+            {'time': '01:12.639000', 'code': 'KRF',
+             'name': 'Kimi Räikkönen', 'team': 'FERRARI'}])
+
+        response = self.client.get('/api/v1/report/drivers/SVF/?format=ndjson')
+        self.assertEqual(len(response.data.splitlines()), 1)
+
+
+class TestDriverLinks(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        main.link_tables.clear()
+        main.response_cache.clear()
+        self.addCleanup(main.link_tables.clear)
+        self.addCleanup(main.response_cache.clear)
+
+    def test_links_are_built_once_per_version(self):
+        with patch('main.url_for', wraps=main.url_for) as mock_url_for:
+            self.client.get('/report/drivers/')
+            self.client.get('/report/drivers/?order=desc')
+            first = self.client.get('/api/v1/report/drivers/?format=xml')
+            second = self.client.get('/api/v1/report/drivers/?format=json')
+        drivers = len(report_racers.build_report('asc'))
+        self.assertEqual(mock_url_for.call_count, 2 * drivers)
+        self.assertIn(b'http://localhost/api/v1/report/drivers/SVF/', first.data)
+        self.assertIn(b'"http://localhost/api/v1/report/drivers/SVF/"', second.data)
+
+    def test_links_follow_the_scheme(self):
+        for base_url in ('http://localhost', 'https://localhost', 'http://localhost'):
+            response = self.client.get('/api/v1/report/drivers/', base_url=base_url)
+            self.assertIn(f'"{base_url}/api/v1/report/drivers/SVF/"'.encode(), response.data)
+
+    def test_html_links(self):
+        response = self.client.get('/report/drivers/')
+        soup = BeautifulSoup(response.data, 'html.parser')
+        self.assertIn('/report/drivers/SVF',
+                      [link['href'] for link in soup.find_all('a')])
+
+    def test_report_is_not_mutated(self):
+        report = report_racers.build_report('asc')
+        before = list(report.items())
+        self.client.get('/api/v1/report/drivers/')
+        self.assertEqual(list(report_racers.build_report('asc').items()), before)
+
+
+class TestRaceCatalog(RaceFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.data_dir
+        self.write_race(self.root / 'monaco')
+        self.write_race(self.root / 'spa', end='SVF2018-05-24_12:04:13.332\n')
+        (self.root / 'empty').mkdir()
+        self.catalog = report_racers.RaceCatalog(self.root, max_races=1)
+        patcher = patch('report_racers.race_catalog', self.catalog)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def test_races_are_loaded_lazily_and_evicted(self):
+        self.assertEqual(self.catalog.races(), ['monaco', 'spa'])
+        self.assertNotIn('monaco', self.catalog)
+        self.assertEqual(self.catalog.build_report('monaco', 'asc'), {
+            '01:04.415000': ('SVF', 'Sebastian Vettel', 'FERRARI')})
+        self.assertIn('monaco', self.catalog)
+        self.catalog.build_report('spa', 'asc')
+        self.assertNotIn('monaco', self.catalog)
+        with self.assertRaises(KeyError):
+            self.catalog.cache('empty')
+
+    def test_size_is_estimated_once_per_table(self):
+        with patch.object(report_racers.LapTable, 'nbytes', return_value=1) as mock_nbytes:
+            for _ in range(3):
+                self.catalog.build_report('monaco', 'asc')
+        self.assertEqual(mock_nbytes.call_count, 1)
+
+    def test_size_follows_the_lazily_built_parts(self):
+        report = self.catalog.build_report('monaco', 'asc')
+        loaded = self.catalog._sizes['monaco'][1]
+        report.table.times, report.table.analytics
+        self.assertGreater(report.index.nbytes(), 0)
+        self.catalog.build_report('monaco', 'desc')
+        self.assertEqual(self.catalog._sizes['monaco'][1],
+                         report.table.nbytes() + report.index.nbytes())
+        self.assertGreater(report.table.nbytes(), loaded)
+
+    def test_unknown_race_does_not_list_the_root(self):
+        with patch.object(self.catalog, 'races') as mock_races:
+            for race_id in ('missing', 'empty', '..'):
+                with self.assertRaises(KeyError):
+                    self.catalog.cache(race_id)
+        mock_races.assert_not_called()
+
+    def test_race_routes(self):
+        response = self.client.get('/api/v1/races/spa/report/')
+        self.assertEqual(json.loads(response.data), {
+            '01:14.415000': ['SVF', 'Sebastian Vettel', 'FERRARI']})
+        response = self.client.get('/api/v1/races/spa/report/drivers/')
+        self.assertIn(b'http://localhost/api/v1/races/spa/report/drivers/SVF/',
+                      response.data)
+        response = self.client.get('/races/monaco/report/drivers/')
+        self.assertIn(b'href="/races/monaco/report/drivers/SVF"', response.data)
+        response = self.client.get('/races/monaco/report/drivers/SVF')
+        self.assertIn('Time : 01:04.415000',
+                      BeautifulSoup(response.data, 'html.parser').get_text())
+        self.assertEqual(
+            self.client.get('/api/v1/races/empty/report/').status_code, 404)
+        self.assertEqual(json.loads(self.client.get('/api/v1/races/').data),
+                         {'races': ['monaco', 'spa']})
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        main.response_cache.clear()
+        self.addCleanup(main.response_cache.clear)
+
+    def test_payload_is_serialized_once(self):
+        with patch('main.RenderJson.dictjson',
+                   wraps=main.RenderJson.dictjson) as mock_dump:
+            first = self.client.get('/api/v1/report/?order=desc')
+            second = self.client.get('/api/v1/report/?order=desc')
+            self.client.get('/api/v1/report/?order=asc')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(mock_dump.call_count, 2)
+
+    def test_if_none_match_returns_304(self):
+        response = self.client.get('/api/v1/report/?format=xml')
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        not_modified = self.client.get(
+            '/api/v1/report/?format=xml', headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+        modified = self.client.get(
+            '/api/v1/report/?format=xml', headers={'If-None-Match': '"other"'})
+        self.assertEqual(modified.status_code, 200)
+
+    def test_payload_is_cached_per_scheme(self):
+        for scheme in ('http', 'https', 'http'):
+            with app.test_request_context('/api/v1/report/', base_url=f'{scheme}://localhost'):
+                response = main.cached_response(lambda: request.scheme.encode(), 'text/plain', 'v1')
+                self.assertEqual(response.get_data(), scheme.encode())
+
+    def test_cache_is_bounded(self):
+        cache = main.ResponseCache(maxsize=2)
+        for key in 'abc':
+            cache.set(key, (key.encode(), key))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), (b'c', 'c'))
+
+
+class TestPagination(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        main.response_cache.clear()
+        self.addCleanup(main.response_cache.clear)
+        self.report = report_racers.build_report('asc')
+
+    def test_report_slice(self):
+        page = self.report.slice(2, 5)
+        self.assertEqual(list(page.items()), list(self.report.items())[2:5])
+        self.assertIs(page.table, self.report.table)
+
+    def test_offset_and_limit(self):
+        response = self.client.get('/api/v1/report/?offset=2&limit=3&format=ndjson')
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        expected = list(self.report.items())[2:5]
+        self.assertEqual([(line['time'], line['code']) for line in lines],
+                         [(time, record[0]) for time, record in expected])
+
+    def test_top_and_fields(self):
+        response = self.client.get('/api/v1/report/drivers/?top=1&fields=code,team&format=xml')
+        root = ET.fromstring(response.data)
+        drivers = root.findall('driver')
+        self.assertEqual(len(drivers), report_racers.TOP_DELIMITER)
+        self.assertEqual([child.tag for child in drivers[0].find('data')], ['code', 'team'])
+        self.assertTrue(drivers[0].find('data/code').text.startswith('http://localhost/'))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/v1/report/?fields=age').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/report/?limit=-1').status_code, 400)
+        for query in ('limit=abc', 'offset=1.5', 'limit=', 'offset=1_0'):
+            self.assertEqual(self.client.get(f'/api/v1/report/?{query}').status_code, 400)
+
+
+class TestASGI(unittest.TestCase):
+    def setUp(self):
+        main.response_cache.clear()
+        self.addCleanup(main.response_cache.clear)
+
+    @staticmethod
+    def call(path, query=b'', headers=()):
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+                 'headers': list(headers), 'server': ('testserver', 80), 'scheme': 'http',
+                 'http_version': '1.1', 'root_path': '', 'client': ('127.0.0.1', 5000)}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi.application(scope, receive, send))
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return messages[0]['status'], dict(messages[0]['headers']), body
+
+    def test_endpoints_match_wsgi(self):
+        client = app.test_client()
+        for path in ('/api/v1/report/', '/api/v1/report/drivers/', '/api/v1/report/drivers/SVF/'):
+            status, headers, body = self.call(path, b'format=xml&order=desc')
+            expected = client.get(path + '?format=xml&order=desc', base_url='http://testserver')
+            self.assertEqual(status, 200)
+            self.assertEqual(body, expected.data)
+
+    def test_endpoints_are_served_natively(self):
+        threads = []
+
+        def load_report(order, race_id=None):
+            threads.append(threading.current_thread())
+            return report_racers.build_report(order)
+
+        with patch('asgi.wsgi', side_effect=AssertionError('served by the WSGI app')), \
+                patch('main.load_report', side_effect=load_report):
+            for path in ('/api/v1/report/', '/api/v1/report/drivers/', '/api/v1/report/drivers/SVF/'):
+                self.assertEqual(self.call(path)[0], 200)
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertIsNone(asgi.native_resource({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/v1/report/drivers/batch/',
+                                                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+                                                'wsgi.url_scheme': 'http'}))
+
+    def test_large_body_is_sent_in_chunks(self):
+        with patch('asgi.CHUNK_SIZE', 1024):
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            environ = {'REQUEST_METHOD': 'GET', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+                       'wsgi.url_scheme': 'http'}
+            asyncio.run(asgi.send_response(main.Response(bytes(2500)), environ, send))
+        self.assertEqual([len(message['body']) for message in messages[1:]], [1024, 1024, 452])
+        self.assertEqual([message['more_body'] for message in messages[1:]], [True, True, False])
+
+    def test_not_modified_and_not_found(self):
+        status, headers, body = self.call('/api/v1/report/')
+        status, _, body = self.call('/api/v1/report/', headers=[(b'if-none-match', headers[b'etag'])])
+        self.assertEqual((status, body), (304, b''))
+        self.assertEqual(self.call('/api/v1/report/drivers/XXX/')[0], 404)
+
+    def test_streamed_body(self):
+        status, headers, body = self.call('/api/v1/report/', b'format=ndjson')
+        self.assertEqual(body, app.test_client().get('/api/v1/report/?format=ndjson').data)
+
+    @patch('main.leaderboard_hub.ensure_watching')
+    def test_stream(self, mock_watching):
+        scope = {'type': 'http', 'method': 'GET', 'path': asgi.STREAM_PATH, 'query_string': b'', 'headers': []}
+        messages = []
+
+        async def run():
+            done = asyncio.Event()
+
+            async def receive():
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if message.get('body'):
+                    done.set()
+                    await asyncio.sleep(0)
+
+            await asyncio.wait_for(asgi.application(scope, receive, send), timeout=5)
+
+        asyncio.run(run())
+        self.assertEqual(dict(messages[0]['headers'])[b'content-type'], b'text/event-stream; charset=utf-8')
+        self.assertIn(b'event: leaderboard', messages[1]['body'])
+        self.assertEqual(len(messages), 2)
+        self.assertFalse(main.leaderboard_hub._subscribers)
+
+
+class TestAppFactory(unittest.TestCase):
+    @patch('report_racers.gc.freeze')
+    def test_create_app_preloads(self, mock_freeze):
+        report_racers.invalidate_cache()
+        application = main.create_app(preload=True)
+        self.assertIsNotNone(report_racers.report_cache._snapshot)
+        mock_freeze.assert_called_once()
+        client = application.test_client()
+        self.assertEqual(client.get('/report/drivers/').status_code, 200)
+        self.assertEqual(client.get('/api/v1/report/drivers/SVF/').data,
+                         app.test_client().get('/api/v1/report/drivers/SVF/').data)
+
+    def test_importing_builds_no_app(self):
+        code = 'import main, wsgi; print(hasattr(main, "app"))'
+        result = subprocess.run([sys.executable, '-c', code], cwd=Path(main.__file__).parent,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_refresher_is_started_by_the_app(self):
+        code = ('import threading, main, report_racers\n'
+                'print(report_racers.refresher, report_racers.report_cache.live)\n'
+                'main.create_app(), main.create_app()\n'
+                'print(report_racers.report_cache.live is not None, '
+                'sum(thread.name == "report-refresher" for thread in threading.enumerate()))')
+        env = dict(os.environ, REPORT_LIVE='1', REPORT_REFRESH_INTERVAL='60')
+        result = subprocess.run([sys.executable, '-c', code], cwd=Path(main.__file__).parent, env=env,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split('\n')[:2], ['None None', 'True 1'])
+
+    @patch('report_racers.start_refresher')
+    def test_after_fork_restarts_refresher(self, mock_start):
+        self.addCleanup(setattr, report_racers.report_cache, 'watched', False)
+        report_racers.report_cache.watched = True
+        with patch('report_racers.refresher', Mock(interval=0.5)):
+            report_racers.after_fork()
+        self.assertFalse(report_racers.report_cache.watched)
+        self.assertFalse(report_racers.report_cache._lock.locked())
+        mock_start.assert_called_once_with(0.5, live=report_racers.report_cache.live is not None)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_locks_held_at_fork_are_renewed(self):
+        def locks():
+            return (main.leaderboard_hub._lock, main.response_cache._lock, main.link_tables._lock,
+                    app.wsgi_app._lock, instrumentation._histograms_lock)
+
+        held = locks()
+        for lock in held:
+            lock.acquire()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', DeprecationWarning)
+                pid = os.fork()
+            if pid == 0:
+                os._exit(0 if all(lock.acquire(timeout=1) for lock in locks()) else 1)
+        finally:
+            for lock in held:
+                lock.release()
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        instrumentation.enable()
+        self.addCleanup(instrumentation.enable, False)
+        self.addCleanup(instrumentation.histograms.clear)
+        main.response_cache.clear()
+        self.addCleanup(main.response_cache.clear)
+        report_racers.invalidate_cache()
+        self.client = main.create_app().test_client()
+
+    def test_stage_is_a_nullcontext_when_disabled(self):
+        instrumentation.enable(False)
+        self.assertIs(instrumentation.stage('render'), instrumentation.stage('parse'))
+        instrumentation.histograms.clear()
+        report_racers.build_report('asc')
+        self.assertEqual(instrumentation.histograms, {})
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get('/api/v1/report/drivers/SVF/?format=xml')
+        stages = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+        for name in ('build_report', 'get_racer_data', 'render', 'request'):
+            self.assertIn(name, stages)
+        self.assertIn('template', self.client.get('/report').headers['Server-Timing'])
+        metrics = self.client.get('/metrics')
+        self.assertTrue(metrics.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'report_stage_seconds_count{stage="request"} 2', metrics.data)
+        self.assertIn(b'report_stage_seconds_bucket{stage="render",le="+Inf"} 1', metrics.data)
+
+    def test_profile_dump(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('instrumentation.PROFILE_DIR', Path(tmp_dir)):
+                response = self.client.get('/api/v1/report/', headers={'X-Profile': '1'})
+            self.assertTrue((Path(tmp_dir) / response.headers['X-Profile']).is_file())
+        self.assertNotIn('X-Profile', self.client.get('/api/v1/report/').headers)
+
+
+class TestDriverBatch(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        main.response_cache.clear()
+        self.addCleanup(main.response_cache.clear)
+
+    def test_get_racers_data(self):
+        report = report_racers.build_report('asc')
+        found, missing = report_racers.get_racers_data(report, ['LHM', 'XXX', 'SVF', 'SVF'])
+        self.assertEqual([record[0] for record in found.values()], ['SVF', 'LHM'])
+        self.assertEqual(missing, ['XXX'])
+        found, missing = report_racers.get_racers_data(dict(report.items()), ['LHM'])
+        self.assertEqual(list(found.values()), [('LHM', 'Lewis Hamilton', 'MERCEDES')])
+
+    def test_query_and_body_return_the_same_records(self):
+        with patch('report_racers.build_report', wraps=report_racers.build_report) as mock_build:
+            by_query = self.client.get('/api/v1/report/drivers/batch/?codes=SVF,XXX&codes=LHM')
+            by_body = self.client.post('/api/v1/report/drivers/batch/', json={'codes': ['SVF', 'XXX', 'LHM']})
+        self.assertEqual(mock_build.call_count, 2)
+        self.assertEqual(by_query.data, by_body.data)
+        data = json.loads(by_query.data)
+        self.assertEqual([record[0] for record in data['drivers'].values()], ['SVF', 'LHM'])
+        self.assertEqual(data['missing'], ['XXX'])
+
+    def test_xml(self):
+        response = self.client.get('/api/v1/report/drivers/batch/?codes=SVF,XXX&format=xml')
+        root = ET.fromstring(response.data)
+        self.assertEqual([code.text for code in root.findall('drivers/driver/data/code')], ['SVF'])
+        self.assertEqual([code.text for code in root.findall('missing/code')], ['XXX'])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/api/v1/report/drivers/batch/').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/report/drivers/batch/?codes=SVF&format=ndjson').status_code, 400)
+        self.assertEqual(self.client.post('/api/v1/report/drivers/batch/', json=['SVF']).status_code, 400)
+        codes = ','.join(['SVF'] * (main.MAX_BATCH_CODES + 1))
+        self.assertEqual(self.client.get(f'/api/v1/report/drivers/batch/?codes={codes}').status_code, 400)
+
+
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        main.response_cache.clear()
+        self.addCleanup(main.response_cache.clear)
+
+    def test_race_analytics(self):
+        table = report_racers.LapTable.from_rows([(3_000_000, 'CCC', 'C', 'B'), (1_000_000, 'AAA', 'A', 'A'),
+                                                  (2_000_000, 'BBB', 'B', 'B'), (2_000_000, 'DDD', 'D', 'A')])
+        analytics = table.analytics
+        self.assertEqual(list(analytics.gaps), [0, 1_000_000, 1_000_000, 2_000_000])
+        self.assertEqual(list(analytics.intervals), [0, 1_000_000, 0, 1_000_000])
+        self.assertEqual(list(analytics.percentiles), [0.0, 25.0, 25.0, 75.0])
+        self.assertEqual([analytics.BAND_NAMES[band] for band in analytics.bands], ['p10', 'p50', 'p50', 'p90'])
+        self.assertEqual(analytics.teams, [('A', 0, 2, 1_500_000), ('B', 1, 2, 2_500_000)])
+        self.assertIs(table.analytics, analytics)
+
+    def test_teams(self):
+        data = json.loads(self.client.get('/api/v1/report/teams/').data)
+        self.assertEqual(list(data)[0], 'FERRARI')
+        self.assertEqual(data['FERRARI'][:3], [1, '01:04.415000', 'SVF'])
+        desc = json.loads(self.client.get('/api/v1/report/teams/?order=desc').data)
+        self.assertEqual(list(desc), list(reversed(list(data))))
+        root = ET.fromstring(self.client.get('/api/v1/report/teams/?format=xml').data)
+        self.assertEqual(root.tag, 'teams')
+        self.assertEqual(root.find('team/name').text, 'FERRARI')
+        self.assertEqual(root.find('team/data/best_code').text, 'SVF')
+
+    def test_gaps(self):
+        data = json.loads(self.client.get('/api/v1/report/gaps/?limit=2').data)
+        self.assertEqual(list(data.values())[0], ['SVF', 'Sebastian Vettel', 'FERRARI', '00:00.000000',
+                                                  '00:00.000000', 0.0, 'p10'])
+        self.assertEqual(list(data.values())[1][3:5], ['00:08.019000', '00:08.019000'])
+        lines = self.client.get('/api/v1/report/gaps/?format=ndjson&offset=1&limit=1').data.splitlines()
+        self.assertEqual(json.loads(lines[0])['code'], 'VBM')
+        root = ET.fromstring(self.client.get('/api/v1/report/gaps/?format=xml&limit=1').data)
+        self.assertEqual(root.find('driver/data/gap').text, '00:00.000000')
+
+    def test_responses_are_cached_with_the_report(self):
+        first = self.client.get('/api/v1/report/gaps/')
+        with patch('report_racers.RaceAnalytics') as mock_analytics:
+            second = self.client.get('/api/v1/report/gaps/')
+        mock_analytics.assert_not_called()
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_unversioned_report(self):
+        with patch('report_racers.build_report', return_value={'01:04.415000': ('SVF', 'Sebastian Vettel', 'FERRARI')}):
+            self.assertEqual(self.client.get('/api/v1/report/teams/').status_code, 404)
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        self.app = main.create_app(config={'CACHE_TYPE': 'SimpleCache'}, share_reports=True)
+        self.backend = main.shared_backend(self.app)
+        self.client = self.app.test_client()
+        main.response_cache.clear()
+        report_racers.invalidate_cache()
+        self.addCleanup(main.response_cache.clear)
+        self.addCleanup(report_racers.invalidate_cache)
+        self.addCleanup(report_racers.share_cache, None)
+
+    def test_default_is_per_worker(self):
+        self.assertIsNone(main.shared_backend(app))
+        self.assertIsNone(main.shared_backend(main.create_app()))
+
+    def test_only_the_entry_point_shares_reports(self):
+        main.create_app(config={'CACHE_TYPE': 'SimpleCache'})
+        self.assertIs(report_racers.report_cache.shared, self.backend)
+        report_racers.share_cache(None)
+        main.create_app(config={'CACHE_TYPE': 'SimpleCache'})
+        self.assertIsNone(report_racers.report_cache.shared)
+
+    def test_snapshot_round_trip(self):
+        table = report_racers.build_report('asc').table
+        loaded = report_racers.load_snapshot(report_racers.dump_snapshot(table))
+        self.assertEqual(list(loaded.durations), list(table.durations))
+        self.assertEqual(loaded.codes, table.codes)
+        self.assertEqual(loaded.version, table.version)
+
+    def test_tables_are_shared_by_version(self):
+        report = report_racers.build_report('asc')
+        self.assertIsNotNone(self.backend.get(report_racers.shared_key(report.version)))
+        report_racers.invalidate_cache()
+        with patch('report_racers.rank_laps') as mock_rank:
+            shared = report_racers.build_report('asc')
+        mock_rank.assert_not_called()
+        self.assertEqual(shared, report)
+        self.assertEqual(shared.version, report.version)
+
+    def test_responses_are_shared(self):
+        first = self.client.get('/api/v1/report/')
+        main.response_cache.clear()
+        with patch('main.RenderJson.dictjson') as mock_dump:
+            second = self.client.get('/api/v1/report/')
+        mock_dump.assert_not_called()
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_broken_backend_falls_back(self):
+        with patch.object(self.backend, 'get', side_effect=ConnectionError), \
+                patch.object(self.backend, 'set', side_effect=ConnectionError), \
+                self.assertLogs(level='WARNING'):
+            self.assertEqual(self.client.get('/api/v1/report/').status_code, 200)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        main.response_cache.clear()
+        self.addCleanup(main.response_cache.clear)
+
+    def test_gzip_is_compressed_once_per_version(self):
+        plain = self.client.get('/api/v1/report/drivers/?format=xml')
+        with patch.dict(main.compressors, {'gzip': Mock(wraps=main.compressors['gzip'])}):
+            first = self.client.get('/api/v1/report/drivers/?format=xml', headers={'Accept-Encoding': 'gzip'})
+            second = self.client.get('/api/v1/report/drivers/?format=xml', headers={'Accept-Encoding': 'gzip'})
+            main.compressors['gzip'].assert_called_once()
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(first.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(second.data), plain.data)
+        self.assertNotEqual(first.headers['ETag'], plain.headers['ETag'])
+        not_modified = self.client.get('/api/v1/report/drivers/?format=xml', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_html_pages_are_compressed(self):
+        response = self.client.get('/report/drivers/', headers={'Accept-Encoding': 'br;q=1, gzip;q=0.5'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br' if main.brotli else 'gzip')
+        self.assertNotIn('Content-Encoding', self.client.get('/report/drivers/').headers)
+
+    def test_small_bodies_are_not_compressed(self):
+        response = self.client.get('/api/v1/report/drivers/SVF/', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.data)['01:04.415000'][0], 'SVF')
+
+
+class TestLazySwagger(unittest.TestCase):
+    def test_heavy_imports_are_deferred(self):
+        code = ('import sys, main; main.create_app(); '
+                'print(sorted({"flasgger", "yaml", "jsonschema", "asyncio", "cProfile"} & set(sys.modules)))')
+        result = subprocess.run([sys.executable, '-c', code], cwd=Path(main.__file__).parent,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_docs_are_built_on_first_request(self):
+        application = main.create_app()
+        self.assertIsNone(application.wsgi_app.docs_app)
+        client = application.test_client()
+        self.assertEqual(client.get('/api/v1/report/').status_code, 200)
+        self.assertIsNone(application.wsgi_app.docs_app)
+        self.assertEqual(client.get('/apidocs/').status_code, 200)
+        spec = json.loads(client.get('/apispec_1.json').data)
+        self.assertIn('/api/v1/report/drivers/batch/', spec['paths'])
+        self.assertIn('post', spec['paths']['/api/v1/report/drivers/batch/'])
+        for path in ('/api/v1/report/', '/api/v1/report/drivers/'):
+            names = [parameter['name'] for parameter in spec['paths'][path]['get']['parameters']]
+            self.assertEqual(names, ['order', 'format', 'offset', 'limit', 'top', 'fields'])
+
+
 if __name__ == '__main__':
     unittest.main()
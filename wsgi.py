@@ -0,0 +1,30 @@
+"""Production entry point of the report web app.
+
+    task_7_flask
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built and the race data parsed when this module is imported. With the
+preload of gunicorn.conf.py that happens once in the master, so the workers forked
+from it share the parsed report copy-on-write instead of each parsing its own.
+Workers and threads per worker are set with the WEB_CONCURRENCY and THREADS
+environment variables, or with the --workers and --threads options.
+"""
+import sys
+from pathlib import Path
+
+import main
+
+CONFIG_FILE = Path(__file__).resolve().parent / 'gunicorn.conf.py'
+
+app = main.create_app(preload=True, share_reports=True)
+
+
+def run():
+    """Serves the app with gunicorn, any extra arguments are passed to gunicorn"""
+    from gunicorn.app.wsgiapp import run as gunicorn_run
+    sys.argv = [sys.argv[0], '--config', str(CONFIG_FILE), *sys.argv[1:], 'wsgi:app']
+    gunicorn_run()
+
+
+if __name__ == '__main__':
+    run()